@@ -0,0 +1,155 @@
+import random
+import types
+import numpy as np
+import constants as const
+from streams import MiningStreams, MaxDraws
+from sweep import DeriveSeed
+
+# Arrival time used for trucks that will not arrive at an unload station again before the simulation ends
+NEVER = np.iinfo(np.int64).max
+
+
+class BatchResult():
+    """ Statistics for a batch of independent simulation replications. Each attribute is a NumPy array with one row per replication.
+
+        Attributes:
+            total_unloads (array): (replications, trucks) number of times each truck unloaded at an unload station
+            total_times_mined (array): (replications, trucks) number of times each truck mined
+            time_spent_waiting (array): (replications, trucks) total time in seconds each truck spent waiting at an unload station
+            time_spent_mining (array): (replications, trucks) total time in seconds each truck spent mining
+            times_traveled (array): (replications, trucks) number of times each truck traveled between a mining location and the unload station
+            station_total_unloads (array): (replications, stations) number of unloads processed by each station
+            station_time_spent_waiting (array): (replications, stations) total time in seconds trucks spent waiting at each station
+    """
+
+    def __init__(self, replications, n, m):
+        """ Initialize a BatchResult with all counters set to zero """
+
+        self.total_unloads = np.zeros((replications, n), dtype=np.int64)
+        self.total_times_mined = np.zeros((replications, n), dtype=np.int64)
+        self.time_spent_waiting = np.zeros((replications, n), dtype=np.int64)
+        self.time_spent_mining = np.zeros((replications, n), dtype=np.int64)
+        self.times_traveled = np.zeros((replications, n), dtype=np.int64)
+        self.station_total_unloads = np.zeros((replications, m), dtype=np.int64)
+        self.station_time_spent_waiting = np.zeros((replications, m), dtype=np.int64)
+
+    def replication(self, r):
+        """ Get the trucks and stations of a single replication, in the same form that RunSimulation returns them. The result can be passed to DisplayStatistics.
+
+            Args:
+                r (int): Index of the replication
+            Returns:
+                tuple (list, list): Objects with the MiningTruck and UnloadStation statistics attributes for each truck and station
+        """
+
+        trucks = [
+            types.SimpleNamespace(
+                id=i+1,
+                total_unloads=int(self.total_unloads[r, i]),
+                total_times_mined=int(self.total_times_mined[r, i]),
+                time_spent_waiting=int(self.time_spent_waiting[r, i]),
+                time_spent_mining=int(self.time_spent_mining[r, i]),
+                times_traveled=int(self.times_traveled[r, i]),
+            )
+            for i in range(self.total_unloads.shape[1])
+        ]
+        stations = [
+            types.SimpleNamespace(
+                id=j+1,
+                total_unloads=int(self.station_total_unloads[r, j]),
+                time_spent_waiting=int(self.station_time_spent_waiting[r, j]),
+            )
+            for j in range(self.station_total_unloads.shape[1])
+        ]
+        return trucks, stations
+
+
+def RunBatchSimulation(n, m, replications, seed=None, distribution=None):
+    """ Run many independent replications of the simulation at once. Truck and station state is stored in NumPy arrays of shape (replications, trucks) and (replications, stations),
+        and every replication is advanced in lockstep, one unload station arrival per replication per step.
+
+        The rules are the same as RunSimulation: a truck unloads at the idle station with the lowest id, or if every station is busy, the station that frees up first.
+        Only arrivals at the unload stations affect other trucks, so the remaining tasks of a truck's cycle (travel, mining) are applied as soon as its arrival is processed, counting only the tasks that start before the simulation ends.
+        Replication r draws its mining times from the streams of DeriveSeed(seed, n, m, r), the seed the same replication of a sweep uses (see sweep.RunReplication), so the trucks'
+        statistics are identical to RunSimulation with that seed. Trucks arriving at the same time are processed in order of truck id, which can differ from the order RunSimulation
+        performs them in, so the statistics of replications with such ties may differ slightly.
+
+        Args:
+            n (int): Number of mining trucks in each replication.
+            m (int): Number of unload stations in each replication.
+            replications (int): Number of independent replications to run.
+            seed (int): Master seed the seed of every replication is derived from; defaults to 64 bits from the random module. Replications are reproducible for the same seed.
+            distribution (instance): Distribution of mining times (see streams.py); defaults to uniform between 1 and 5 hours.
+        Returns:
+            BatchResult: Truck and station statistics for every replication
+    """
+
+    if n < 1 or m < 1:
+        raise ValueError("The number of mining trucks and unload stations must be greater than zero")
+
+    if seed is None:
+        seed = random.getrandbits(64)
+    result = BatchResult(replications, n, m)
+
+    # Sample every mining time a truck can draw before the end of the simulation, plus the one drawn by its last arrival, for every replication
+    streams = [MiningStreams(0, DeriveSeed(seed, n, m, r), distribution) for r in range(replications)]
+    cycles = MaxDraws(const.TOTAL_SIM_TIME, streams[0].distribution) + 1
+    durations = np.stack([replication_streams.sample(0, n, cycles) for replication_streams in streams]) if replications else np.zeros((0, n, cycles), dtype=np.int64)
+    draws = np.ones((replications, n), dtype=np.int64)
+
+    # Every truck starts mining at time 0, then travels to the unload stations
+    mining_time = durations[:, :, 0]
+    result.total_times_mined += 1
+    result.time_spent_mining += mining_time
+    result.times_traveled += 1
+    arrival = mining_time + const.TRAVEL_TIME
+
+    # The time at which each station finishes unloading every truck in its queue
+    tail_free_time = np.zeros((replications, m), dtype=np.int64)
+
+    while True:
+        # Find the next truck to arrive at an unload station in each replication
+        truck = arrival.argmin(axis=1)
+        time = arrival[np.arange(replications), truck]
+
+        # Only replications with an arrival before the end of the simulation take part in this step
+        active = np.flatnonzero(time <= const.TOTAL_SIM_TIME)
+        if not len(active):
+            break
+        truck = truck[active]
+        time = time[active]
+
+        # Pick the idle station with the lowest id, otherwise the busy station that frees up first
+        tails = tail_free_time[active]
+        idle = tails <= time[:, None]
+        has_idle = idle.any(axis=1)
+        station = np.where(has_idle, idle.argmax(axis=1), tails.argmin(axis=1))
+        wait = np.where(has_idle, 0, tails[np.arange(len(active)), station] - time)
+
+        start_unload = time + wait
+        tail_free_time[active, station] = start_unload + const.UNLOAD_TIME
+
+        result.time_spent_waiting[active, truck] += wait
+        result.station_time_spent_waiting[active, station] += wait
+
+        # The unload is only counted if it completes before the simulation ends
+        unloaded = start_unload + const.UNLOAD_TIME <= const.TOTAL_SIM_TIME
+        result.total_unloads[active, truck] += unloaded
+        result.station_total_unloads[active, station] += unloaded
+
+        # The truck travels back to a mining location once it starts unloading, then mines and travels to the unload stations again
+        result.times_traveled[active, truck] += start_unload <= const.TOTAL_SIM_TIME
+        start_mining = start_unload + const.TRAVEL_TIME
+        mines = start_mining <= const.TOTAL_SIM_TIME
+
+        # Like MiningTruck.startMining, draw the truck's next mining time from its own stream
+        mining_time = durations[active, truck, np.minimum(draws[active, truck], cycles - 1)]
+        draws[active, truck] += 1
+        result.total_times_mined[active, truck] += mines
+        result.time_spent_mining[active, truck] += np.where(mines, mining_time, 0)
+
+        end_mining = start_mining + mining_time
+        result.times_traveled[active, truck] += mines & (end_mining <= const.TOTAL_SIM_TIME)
+        arrival[active, truck] = np.where(mines, end_mining + const.TRAVEL_TIME, NEVER)
+
+    return result
@@ -0,0 +1,250 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import resource
+import sys
+import time
+from fast_path import IsContentionFree
+from simulation import RunSimulation, ENGINES, SCHEDULERS, MiningTruck, UnloadStation, UnloadStationIndex, GetNextUnloadStation, TASK_PRIORITY_DEFAULT
+
+# Fleet sizes and station counts benchmarked by default, and by --full
+QUICK_GRID = {'trucks': (10, 100, 1000), 'stations': (1, 10)}
+FULL_GRID = {'trucks': (10, 100, 1000, 10000, 100000), 'stations': (1, 10, 100)}
+
+# Queue depths and station counts for the micro-benchmarks
+SCHEDULER_DEPTHS = (10, 1000, 10000)
+STATION_COUNTS = (10, 100, 1000)
+
+# Micro-benchmarks run batches of operations until at least this much time (in seconds) has passed
+MIN_SECONDS = 0.2
+BATCH_SIZE = 100
+
+# Each simulation benchmark is run this many times and the fastest run is kept, to reduce noise
+DEFAULT_REPEAT = 3
+
+# A benchmark fails when its throughput drops by more than this fraction of the baseline
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Name benchmarks of the contention-free fast path are recorded under, in place of an engine
+FAST_PATH = 'fast_path'
+
+
+def CountEvents(mining_trucks):
+    """ Count the tasks performed by the object engine to produce the given statistics: one per mining operation and trip, and two per unload (arrival and completion).
+        The count is the same for every engine, so throughputs can be compared even though the coalesced engine performs fewer tasks.
+
+        Args:
+            mining_trucks (list): The mining trucks returned by RunSimulation
+        Returns:
+            int: The number of tasks
+    """
+    return sum(truck.total_times_mined + truck.times_traveled + 2*truck.total_unloads for truck in mining_trucks)
+
+def BenchmarkSimulation(engine, n, m, seed=0, repeat=DEFAULT_REPEAT):
+    """ Time runs of the simulation and keep the fastest. Run in a fresh process so its peak memory isn't affected by earlier benchmarks.
+        The engine's event loop is timed even for contention-free configurations; pass FAST_PATH as the engine to time the fast path instead.
+
+        Args:
+            engine (str): Simulation engine to benchmark, or FAST_PATH
+            n (int): Number of mining trucks
+            m (int): Number of unload stations
+            seed (int): Seed for the random module; every run uses the same seed
+            repeat (int): Number of runs
+        Returns:
+            dict: The number of tasks, wall time, tasks per second and peak memory growth (in KB) of the fastest run
+    """
+
+    fast_path = engine == FAST_PATH
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed = None
+    for _ in range(repeat):
+        random.seed(seed)
+        start = time.perf_counter()
+        mining_trucks, _ = RunSimulation(n, m, display=False, engine='object' if fast_path else engine, fast_path=fast_path)
+        run_time = time.perf_counter() - start
+        elapsed = run_time if elapsed is None else min(elapsed, run_time)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    events = CountEvents(mining_trucks)
+    return {
+        'events': events,
+        'seconds': elapsed,
+        'events_per_second': events/elapsed,
+        'peak_memory_kb': rss_after - rss_before,
+    }
+
+def BenchmarkScheduler(scheduler, depth):
+    """ Time enqueue/getCurrentTask pairs on a task queue holding a fixed number of tasks.
+
+        Args:
+            scheduler (str): Name of the task queue implementation (see SCHEDULERS)
+            depth (int): Number of tasks in the queue while it is being timed
+        Returns:
+            dict: Operations (enqueue/getCurrentTask pairs) per second
+    """
+
+    rng = random.Random(0)
+    task_queue = SCHEDULERS[scheduler]()
+    truck = MiningTruck(1, task_queue)
+    task_queue.getCurrentTask()
+    for _ in range(depth):
+        task_queue.enqueue((truck.startMining, rng.randint(0, 1000000)), TASK_PRIORITY_DEFAULT)
+
+    operations = 0
+    elapsed = 0
+    while elapsed < MIN_SECONDS:
+        times = [rng.randint(0, 1000000) for _ in range(BATCH_SIZE)]
+        start = time.perf_counter()
+        for task_time in times:
+            task_queue.enqueue((truck.startMining, task_time), TASK_PRIORITY_DEFAULT)
+            task_queue.getCurrentTask()
+        elapsed += time.perf_counter() - start
+        operations += BATCH_SIZE
+
+    return {'operations_per_second': operations/elapsed}
+
+def BenchmarkStationSelection(method, m):
+    """ Time selecting an unload station and queueing a truck at it, with every station busy.
+
+        Args:
+            method (str): 'scan' for GetNextUnloadStation or 'index' for UnloadStationIndex
+            m (int): Number of unload stations
+        Returns:
+            dict: Operations (selections) per second
+    """
+
+    stations = [UnloadStation(i+1) for i in range(m)]
+    index = UnloadStationIndex(stations) if method == 'index' else None
+    truck = MiningTruck(1, SCHEDULERS['heap']())
+
+    cur_time = 0
+    elapsed = 0
+    while elapsed < MIN_SECONDS:
+        start = time.perf_counter()
+        for cur_time in range(cur_time, cur_time + BATCH_SIZE):
+            if method == 'scan':
+                station = GetNextUnloadStation(stations, cur_time)
+                station.enqueue(truck, cur_time)
+            else:
+                station = index.getNextUnloadStation(cur_time)
+                station.enqueue(truck, cur_time)
+                index.update(station)
+        elapsed += time.perf_counter() - start
+        cur_time += 1
+
+    return {'operations_per_second': cur_time/elapsed}
+
+def _RunInFreshProcess(func, *args):
+    """ Run a benchmark in a new worker process and return its result """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func, *args).result()
+
+def RunBenchmarks(grid=QUICK_GRID, engines=ENGINES, micro=True, log=None):
+    """ Run the simulation benchmarks over a grid of fleet sizes and station counts, and optionally the micro-benchmarks.
+
+        Args:
+            grid (dict): Numbers of trucks ('trucks') and stations ('stations') to benchmark
+            engines (iterable): Simulation engines to benchmark
+            micro (bool): Also run the scheduler and station selection micro-benchmarks
+            log (file): File to write progress to, e.g. sys.stdout
+        Returns:
+            dict: Results keyed by benchmark name, e.g. 'simulation/compact/n=1000/m=10' or 'scheduler/heap/depth=1000'. Contention-free configurations
+                  are also benchmarked with the fast path, e.g. 'simulation/fast_path/n=10/m=10'.
+    """
+
+    benchmarks = []
+    for engine in engines:
+        for n in grid['trucks']:
+            for m in grid['stations']:
+                benchmarks.append(('simulation/{}/n={}/m={}'.format(engine, n, m), BenchmarkSimulation, (engine, n, m)))
+    for n in grid['trucks']:
+        for m in grid['stations']:
+            if IsContentionFree(n, m):
+                benchmarks.append(('simulation/{}/n={}/m={}'.format(FAST_PATH, n, m), BenchmarkSimulation, (FAST_PATH, n, m)))
+    if micro:
+        for scheduler in sorted(SCHEDULERS):
+            for depth in SCHEDULER_DEPTHS:
+                benchmarks.append(('scheduler/{}/depth={}'.format(scheduler, depth), BenchmarkScheduler, (scheduler, depth)))
+        for method in ('scan', 'index'):
+            for m in STATION_COUNTS:
+                benchmarks.append(('station_selection/{}/m={}'.format(method, m), BenchmarkStationSelection, (method, m)))
+
+    results = {}
+    for name, func, args in benchmarks:
+        results[name] = _RunInFreshProcess(func, *args)
+        if log:
+            print("{:<45s} {}".format(name, FormatResult(results[name])), file=log, flush=True)
+    return results
+
+def Throughput(result):
+    """ Return the throughput of a benchmark result: tasks per second for simulations, operations per second for micro-benchmarks """
+    return result.get('events_per_second', result.get('operations_per_second'))
+
+def FormatResult(result):
+    """ Format a benchmark result for display """
+    text = "{:>14,.0f} /s".format(Throughput(result))
+    if 'peak_memory_kb' in result:
+        text += "  {:>10,d} KB peak".format(result['peak_memory_kb'])
+    return text
+
+def CompareToBaseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Find the benchmarks whose throughput regressed compared to a baseline. Benchmarks missing from the baseline are skipped.
+
+        Args:
+            results (dict): Results returned by RunBenchmarks
+            baseline (dict): Results of an earlier run, e.g. loaded from a baseline file
+            threshold (float): Fraction of the baseline throughput a benchmark may drop by before it counts as a regression
+        Returns:
+            list: (name, baseline throughput, current throughput) for every regressed benchmark
+    """
+
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = Throughput(baseline[name])
+        actual = Throughput(result)
+        if actual < expected*(1 - threshold):
+            regressions.append((name, expected, actual))
+    return regressions
+
+def ParseArgs(argv=None):
+    """ Parse the benchmark suite's command line arguments """
+
+    parser = argparse.ArgumentParser(description='Benchmark the simulation and its hot paths')
+    parser.add_argument('--full', action='store_true', help='Benchmark fleets of up to 100,000 trucks and 100 stations')
+    parser.add_argument('--engine', choices=ENGINES, action='append', help='Engine to benchmark (may be repeated; defaults to every engine)')
+    parser.add_argument('--no-micro', action='store_true', help='Skip the scheduler and station selection micro-benchmarks')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file the results are compared to; created if it does not exist')
+    parser.add_argument('--update-baseline', action='store_true', help='Overwrite the baseline with the results of this run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Fraction of the baseline throughput a benchmark may drop by before failing')
+    return parser.parse_args(argv)
+
+def Main(argv=None):
+    """ Run the benchmark suite, compare it to the baseline and return the exit status: 1 if any benchmark regressed, otherwise 0 """
+
+    args = ParseArgs(argv)
+    results = RunBenchmarks(FULL_GRID if args.full else QUICK_GRID, args.engine or ENGINES, micro=not args.no_micro, log=sys.stdout)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("\nBaseline written to {}".format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = CompareToBaseline(results, baseline, args.threshold)
+    for name, expected, actual in regressions:
+        print("REGRESSION {}: {:,.0f}/s -> {:,.0f}/s ({:.0%})".format(name, expected, actual, actual/expected - 1))
+
+    print("\n{} benchmarks, {} regressions (threshold {:.0%})".format(len(results), len(regressions), args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
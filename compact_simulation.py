@@ -0,0 +1,468 @@
+import array
+import heapq
+import os
+import pickle
+import constants as const
+from streams import MiningStreams
+
+# Measured peak memory of RunCompactSimulation per mining truck, including the truck's pending events and the views returned at the end of the run (see tests/unit_test.py).
+# For comparison, the object engine in simulation.py uses roughly 870 bytes per truck.
+BYTES_PER_TRUCK = 290
+
+# Task types. Tasks refer to trucks by their index rather than holding a bound method of a MiningTruck.
+EVENT_START_MINING = 0
+EVENT_GO_TO_UNLOAD_STATION = 1
+EVENT_UNLOAD = 2
+EVENT_GO_TO_MINING_LOCATION = 3
+EVENT_UNLOAD_COMPLETE = 4
+
+# Priorities for tasks performed at the same time; unload completions run first (see TASK_PRIORITY_* in simulation.py)
+PRIORITY_UNLOAD_COMPLETE = 0
+PRIORITY_DEFAULT = 1
+
+# Each task is encoded as a single integer so the task queue holds one small object per task:
+#   time | priority (1 bit) | origin time | sequence number | task type | truck index
+# Comparing the integers orders tasks by time, then priority, then the order they were scheduled in.
+# The origin time is only used when tasks are coalesced (see RunCompactSimulation); otherwise it is 0.
+# Unload completions hold the station index in place of the truck index and the truck index in place of the origin time, since the truck may have
+# arrived at another station by the time its unload completes.
+# With these widths a 72 hour task fits in a 4 digit Python int (120 bits), and fleets of up to 16 million trucks are supported.
+ID_BITS = 24
+EVENT_BITS = 3
+SEQ_BITS = 36
+ORIGIN_BITS = 36
+ID_MASK = (1 << ID_BITS) - 1
+EVENT_MASK = (1 << EVENT_BITS) - 1
+ORIGIN_MASK = (1 << ORIGIN_BITS) - 1
+ORIGIN_SHIFT = ID_BITS + EVENT_BITS + SEQ_BITS
+TIME_SHIFT = ID_BITS + EVENT_BITS + SEQ_BITS + ORIGIN_BITS + 1
+
+
+def EncodeEvent(time, priority, seq, event, truck, origin=0):
+    """ Encode a task as an integer that sorts by time, priority, origin time and sequence number.
+
+        Args:
+            time (int): Time at which the task should be performed
+            priority (int): PRIORITY_UNLOAD_COMPLETE or PRIORITY_DEFAULT
+            seq (int): Sequence number of the task; tasks with the same time, priority and origin time run in order of their sequence number
+            event (int): Type of the task (EVENT_*)
+            truck (int): Index of the truck performing the task (of the station, for EVENT_UNLOAD_COMPLETE)
+            origin (int): Time at which the coalesced task preceding this one would have been performed (index of the truck, for EVENT_UNLOAD_COMPLETE)
+        Returns:
+            int: The encoded task
+    """
+    return (((((time << 1 | priority) << ORIGIN_BITS | origin) << SEQ_BITS | seq) << EVENT_BITS | event) << ID_BITS) | truck
+
+# Version of the snapshot format written by CompactSimulation.save
+SNAPSHOT_VERSION = 3
+
+
+def DecodeEvent(key):
+    """ Decode a task encoded with EncodeEvent.
+
+        Returns:
+            tuple (int, int, int): The time, task type and truck index of the task
+    """
+    return key >> TIME_SHIFT, (key >> ID_BITS) & EVENT_MASK, key & ID_MASK
+
+
+class FleetStore():
+    """ Compact storage for the state of every mining truck and unload station. Each statistic is a typed array indexed by truck or station index (id - 1).
+
+        Attributes:
+            total_unloads, total_times_mined, time_spent_waiting, time_spent_mining, times_traveled (array): Truck statistics, see MiningTruck
+            truck_station (array): Index of the station each truck last unloaded at
+            station_total_unloads, station_time_spent_waiting (array): Station statistics, see UnloadStation
+            tail_free_time (array): The time at which each station finishes unloading every truck in its queue
+    """
+
+    __slots__ = ('total_unloads', 'total_times_mined', 'time_spent_waiting', 'time_spent_mining', 'times_traveled', 'truck_station',
+                 'station_total_unloads', 'station_time_spent_waiting', 'tail_free_time')
+
+    def __init__(self, n, m):
+        """ Initialize a FleetStore for n trucks and m stations with all statistics set to zero """
+
+        self.total_unloads = array.array('q', bytes(8*n))
+        self.total_times_mined = array.array('q', bytes(8*n))
+        self.time_spent_waiting = array.array('q', bytes(8*n))
+        self.time_spent_mining = array.array('q', bytes(8*n))
+        self.times_traveled = array.array('q', bytes(8*n))
+        self.truck_station = array.array('i', bytes(4*n))
+
+        self.station_total_unloads = array.array('q', bytes(8*m))
+        self.station_time_spent_waiting = array.array('q', bytes(8*m))
+        self.tail_free_time = array.array('q', bytes(8*m))
+
+    def copy(self):
+        """ Return a copy of this store """
+        store = FleetStore(0, 0)
+        for name in self.__slots__:
+            setattr(store, name, array.array(getattr(self, name).typecode, getattr(self, name)))
+        return store
+
+    def trucks(self):
+        """ Return a MiningTruckView for every truck in the store """
+        return [MiningTruckView(self, i) for i in range(len(self.total_unloads))]
+
+    def stations(self):
+        """ Return an UnloadStationView for every station in the store """
+        return [UnloadStationView(self, i) for i in range(len(self.tail_free_time))]
+
+
+def StoreEntities(mining_trucks, unload_stations):
+    """ Copy the statistics of a run's trucks and stations into a FleetStore, which is compact to send between processes or save to disk.
+
+        Args:
+            mining_trucks (list): Mining trucks returned by RunSimulation
+            unload_stations (list): Unload stations returned by RunSimulation
+        Returns:
+            FleetStore: The statistics of every truck and station
+    """
+
+    store = FleetStore(0, 0)
+    for name in ('total_unloads', 'total_times_mined', 'time_spent_waiting', 'time_spent_mining', 'times_traveled'):
+        setattr(store, name, array.array('q', (getattr(truck, name) for truck in mining_trucks)))
+    store.truck_station = array.array('i', bytes(4*len(mining_trucks)))
+    store.station_total_unloads = array.array('q', (station.total_unloads for station in unload_stations))
+    store.station_time_spent_waiting = array.array('q', (station.time_spent_waiting for station in unload_stations))
+    store.tail_free_time = array.array('q', (station.tail_free_time for station in unload_stations))
+    return store
+
+
+class MiningTruckView():
+    """ Thin view of a truck in a FleetStore with the same statistics attributes as MiningTruck, so it can be used with DisplayStatistics. """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def id(self):
+        return self._index + 1
+
+    @property
+    def total_unloads(self):
+        return self._store.total_unloads[self._index]
+
+    @property
+    def total_times_mined(self):
+        return self._store.total_times_mined[self._index]
+
+    @property
+    def time_spent_waiting(self):
+        return self._store.time_spent_waiting[self._index]
+
+    @property
+    def time_spent_mining(self):
+        return self._store.time_spent_mining[self._index]
+
+    @property
+    def times_traveled(self):
+        return self._store.times_traveled[self._index]
+
+
+class UnloadStationView():
+    """ Thin view of a station in a FleetStore with the same statistics attributes as UnloadStation, so it can be used with DisplayStatistics. """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def id(self):
+        return self._index + 1
+
+    @property
+    def total_unloads(self):
+        return self._store.station_total_unloads[self._index]
+
+    @property
+    def time_spent_waiting(self):
+        return self._store.station_time_spent_waiting[self._index]
+
+    @property
+    def tail_free_time(self):
+        return self._store.tail_free_time[self._index]
+
+
+class CompactSimulation():
+    """ The complete state of a simulation run by the compact engine: the FleetStore, the pending tasks, the idle and busy stations, and the time the simulation has been run up to.
+        The simulation can be advanced to any horizon, saved to a snapshot on disk and resumed or extended to a later horizon. Along with the trucks' mining time streams,
+        which are saved in the snapshot, this is everything needed to produce results identical to an uninterrupted run.
+
+        Stations are selected the same way as UnloadStationIndex: the idle station with the lowest index, otherwise the busy station that frees up first.
+        Since a truck leaves its station's queue when its unload completes, a station is idle once its tail_free_time has passed and the stations don't need to keep their queues.
+
+        When coalesce is True, only the tasks that make decisions (start mining and unload) go through the task queue; the others are folded into them:
+            start mining -> unload at the station at end of mining + TRAVEL_TIME
+            unload -> start mining at end of waiting + TRAVEL_TIME
+        This cuts the tasks per cycle from five to two. The unload completion is only folded when UNLOAD_TIME is at most TRAVEL_TIME, so it always happens before the start of mining
+        that replaced it; otherwise it stays a task of its own. The folded trips and unload completions are counted when the task that replaced them is performed, or by results()
+        if they happened before the horizon but the replacing task hasn't been performed yet. To perform tasks in the same order as RunSimulation, a task scheduled for the same
+        time as others is ordered by the time and sequence number of the task it replaced (its origin), which is the order RunSimulation would have scheduled it in.
+
+        Attributes:
+            store (FleetStore): Truck and station state
+            coalesce (bool): Fold the travel and unload completion tasks into the tasks that schedule them
+            time (int): Every task scheduled at or before this time has been performed (-1 before the simulation starts)
+            task_queue (list): Heap of pending tasks encoded with EncodeEvent
+            streams (MiningStreams): The mining time stream of every truck
+    """
+
+    def __init__(self, n, m, coalesce=False, seed=None, distribution=None):
+        """ Initialize a CompactSimulation of n trucks and m stations, with every truck about to start mining. The seed and distribution are passed to MiningStreams. """
+
+        # Tasks and busy stations hold truck and station indexes in ID_BITS bits
+        if max(n, m) > ID_MASK + 1:
+            raise ValueError("The compact engine supports at most {} mining trucks and unload stations".format(ID_MASK + 1))
+
+        self.store = FleetStore(n, m)
+        self.coalesce = coalesce
+        self.streams = MiningStreams(n, seed, distribution)
+        self.time = -1
+
+        # Every truck starts the simulation by mining
+        self.task_queue = [EncodeEvent(0, PRIORITY_DEFAULT, i, EVENT_START_MINING, i) for i in range(n)]
+        self._seq = n
+
+        # Idle stations by index, and busy stations encoded as tail_free_time << ID_BITS | index
+        self._idle = list(range(m))
+        self._busy = []
+
+    def run(self, horizon, checkpoint_interval=None, checkpoint_path=None):
+        """ Perform every task scheduled at or before the horizon.
+
+            Args:
+                horizon (int): Time (in seconds) to run the simulation up to
+                checkpoint_interval (int): Save a snapshot every time this many seconds of simulated time have passed
+                checkpoint_path (str): Path the snapshots are saved to. A snapshot is also saved once the horizon is reached.
+        """
+
+        if checkpoint_interval is not None and checkpoint_interval <= 0:
+            raise ValueError("The checkpoint interval must be positive")
+
+        while self.time < horizon:
+            stop = horizon
+            if checkpoint_interval:
+                stop = min(horizon, (max(self.time, 0)//checkpoint_interval + 1)*checkpoint_interval)
+            self._advance(stop)
+            if checkpoint_path:
+                self.save(checkpoint_path)
+
+    def _advance(self, horizon):
+        """ Perform every task scheduled at or before the horizon, without checkpoints """
+
+        store = self.store
+        total_unloads = store.total_unloads
+        total_times_mined = store.total_times_mined
+        time_spent_waiting = store.time_spent_waiting
+        time_spent_mining = store.time_spent_mining
+        times_traveled = store.times_traveled
+        truck_station = store.truck_station
+        station_total_unloads = store.station_total_unloads
+        station_time_spent_waiting = store.station_time_spent_waiting
+        tail_free_time = store.tail_free_time
+
+        task_queue = self.task_queue
+        idle = self._idle
+        busy = self._busy
+        seq = self._seq
+        coalesce = self.coalesce
+        fold_unload = coalesce and const.UNLOAD_TIME <= const.TRAVEL_TIME
+
+        push = heapq.heappush
+        pop = heapq.heappop
+        draw = self.streams.draw
+
+        # Tasks after the horizon are left in the queue so the simulation can be extended
+        while task_queue and task_queue[0] >> TIME_SHIFT <= horizon:
+            key = pop(task_queue)
+            time = key >> TIME_SHIFT
+            event = (key >> ID_BITS) & EVENT_MASK
+            truck = key & ID_MASK
+
+            if event == EVENT_START_MINING:
+                if coalesce:
+                    # Count the trip from the unload station and, if it was folded, the unload this task replaced; trucks have no previous unload at the start of the simulation
+                    origin = (key >> ORIGIN_SHIFT) & ORIGIN_MASK
+                    if origin:
+                        times_traveled[truck] += 1
+                        if fold_unload:
+                            station_total_unloads[truck_station[truck]] += 1
+                            total_unloads[truck] += 1
+
+                mining_time = draw(truck)
+                time_spent_mining[truck] += mining_time
+                total_times_mined[truck] += 1
+
+                if coalesce:
+                    # Travel to the unload station as soon as mining ends
+                    end_mining = time + mining_time
+                    push(task_queue, EncodeEvent(end_mining + const.TRAVEL_TIME, PRIORITY_DEFAULT, seq, EVENT_UNLOAD, truck, end_mining))
+                    seq += 1
+                    continue
+
+                next_event, next_time = EVENT_GO_TO_UNLOAD_STATION, time + mining_time
+
+            elif event == EVENT_GO_TO_UNLOAD_STATION:
+                times_traveled[truck] += 1
+                next_event, next_time = EVENT_UNLOAD, time + const.TRAVEL_TIME
+
+            elif event == EVENT_UNLOAD:
+                if coalesce:
+                    # Count the trip to the unload station this task replaced
+                    times_traveled[truck] += 1
+
+                # Move stations that have finished unloading every truck in their queue to the idle heap, discarding stale entries
+                while busy and busy[0] >> ID_BITS <= time:
+                    entry = pop(busy)
+                    station = entry & ID_MASK
+                    if tail_free_time[station] == entry >> ID_BITS:
+                        push(idle, station)
+
+                if idle:
+                    station = pop(idle)
+                    queue_time = 0
+                else:
+                    while tail_free_time[busy[0] & ID_MASK] != busy[0] >> ID_BITS:
+                        pop(busy)
+                    station = busy[0] & ID_MASK
+                    queue_time = tail_free_time[station] - time
+
+                time_spent_waiting[truck] += queue_time
+                station_time_spent_waiting[station] += queue_time
+                truck_station[truck] = station
+
+                unload_complete = time + queue_time + const.UNLOAD_TIME
+                tail_free_time[station] = unload_complete
+                push(busy, unload_complete << ID_BITS | station)
+
+                if coalesce:
+                    # Travel to a mining location once the truck starts unloading. RunSimulation schedules the unload completion first, so the trip takes the next sequence number
+                    leave_time = time + queue_time
+                    push(task_queue, EncodeEvent(leave_time + const.TRAVEL_TIME, PRIORITY_DEFAULT, seq + 1, EVENT_START_MINING, truck, leave_time))
+                    if not fold_unload:
+                        push(task_queue, EncodeEvent(unload_complete, PRIORITY_UNLOAD_COMPLETE, seq, EVENT_UNLOAD_COMPLETE, station, truck))
+                    seq += 2
+                    continue
+
+                push(task_queue, EncodeEvent(unload_complete, PRIORITY_UNLOAD_COMPLETE, seq, EVENT_UNLOAD_COMPLETE, station, truck))
+                seq += 1
+                next_event, next_time = EVENT_GO_TO_MINING_LOCATION, time + queue_time
+
+            elif event == EVENT_GO_TO_MINING_LOCATION:
+                times_traveled[truck] += 1
+                next_event, next_time = EVENT_START_MINING, time + const.TRAVEL_TIME
+
+            else:
+                station_total_unloads[truck] += 1
+                total_unloads[(key >> ORIGIN_SHIFT) & ORIGIN_MASK] += 1
+                continue
+
+            push(task_queue, EncodeEvent(next_time, PRIORITY_DEFAULT, seq, next_event, truck))
+            seq += 1
+
+        self._seq = seq
+        self.time = horizon
+
+    def results(self):
+        """ Get the statistics of every truck and station at the time the simulation has been run up to.
+
+            Returns:
+                tuple (list, list): MiningTruckView and UnloadStationView instances for every truck and station
+        """
+
+        store = self.store
+        if self.coalesce:
+            # Count the folded trips and unload completions that happened before the horizon but whose replacing task is still pending, without changing the simulation's state
+            store = store.copy()
+            fold_unload = const.UNLOAD_TIME <= const.TRAVEL_TIME
+            for key in self.task_queue:
+                origin = (key >> ORIGIN_SHIFT) & ORIGIN_MASK
+                if not origin or origin > self.time or (key >> ID_BITS) & EVENT_MASK == EVENT_UNLOAD_COMPLETE:
+                    continue
+                truck = key & ID_MASK
+                store.times_traveled[truck] += 1
+                if fold_unload and (key >> ID_BITS) & EVENT_MASK == EVENT_START_MINING and origin + const.UNLOAD_TIME <= self.time:
+                    store.station_total_unloads[store.truck_station[truck]] += 1
+                    store.total_unloads[truck] += 1
+
+        return store.trucks(), store.stations()
+
+    def save(self, path):
+        """ Save a snapshot of the simulation, including the trucks' mining time streams. The snapshot is written to a temporary file and moved into place, so an existing snapshot is never left half written.
+
+            Args:
+                path (str): Path of the snapshot file
+        """
+
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'coalesce': self.coalesce,
+            'time': self.time,
+            'seq': self._seq,
+            'task_queue': self.task_queue,
+            'idle': self._idle,
+            'busy': self._busy,
+            'store': {name: getattr(self.store, name) for name in FleetStore.__slots__},
+            'streams': self.streams,
+        }
+
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a simulation from a snapshot saved with save. The trucks' mining time streams are restored with it, so the simulation continues exactly as it would have.
+
+            Args:
+                path (str): Path of the snapshot file
+            Returns:
+                CompactSimulation: The simulation as it was when the snapshot was saved
+        """
+
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version: {}".format(snapshot.get('version')))
+
+        simulation = cls(0, 0, snapshot['coalesce'], seed=0)
+        simulation.time = snapshot['time']
+        simulation._seq = snapshot['seq']
+        simulation.task_queue = snapshot['task_queue']
+        simulation._idle = snapshot['idle']
+        simulation._busy = snapshot['busy']
+        for name, values in snapshot['store'].items():
+            setattr(simulation.store, name, values)
+        simulation.streams = snapshot['streams']
+        return simulation
+
+
+def RunCompactSimulation(n, m, coalesce=False, horizon=None, checkpoint_interval=None, checkpoint_path=None, seed=None, distribution=None):
+    """ Run the simulation with fleet state kept in a FleetStore and tasks encoded as integers (see EncodeEvent and CompactSimulation).
+        Tasks are performed in the same order as RunSimulation and mining times are drawn from the same per-truck streams, so the results are identical for the same seed.
+
+        Args:
+            n (int): Number of mining trucks in the simulation.
+            m (int): Number of unload stations in the simulation.
+            coalesce (bool): Fold the travel and unload completion tasks into the task that schedules them.
+            horizon (int): Time (in seconds) to run the simulation up to; defaults to TOTAL_SIM_TIME.
+            checkpoint_interval (int): Save a snapshot every time this many seconds of simulated time have passed.
+            checkpoint_path (str): Path the snapshots are saved to; see CompactSimulation.load to resume from one.
+            seed (int): Master seed of the trucks' mining time streams (see MiningStreams); defaults to one drawn from the random module.
+            distribution (instance): Distribution of mining times (see streams.py); defaults to uniform between 1 and 5 hours.
+        Returns:
+            tuple (list, list): MiningTruckView and UnloadStationView instances for every truck and station
+    """
+
+    if horizon is None:
+        horizon = const.TOTAL_SIM_TIME
+    simulation = CompactSimulation(n, m, coalesce, seed, distribution)
+    simulation.run(horizon, checkpoint_interval, checkpoint_path)
+    return simulation.results()
@@ -0,0 +1,170 @@
+import math
+
+# Quantiles returned by QuantileSketch are within this relative error of the exact quantile
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY)/(1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Most bins a sketch keeps; past this the lowest bins are collapsed together, so memory stays fixed however many values are added.
+# Values between 1 and 10^8 need fewer than this many bins, so collapsing only happens for extreme ranges.
+MAX_BINS = 1024
+
+# Quantiles reported by QuantileSketch.summary
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class QuantileSketch():
+    """ Streaming summary of a distribution of non-negative values with fixed memory: count, min, max, mean and variance, plus quantiles within RELATIVE_ACCURACY.
+        Values are counted in logarithmically sized bins (as in DDSketch), so sketches of the same quantity from different runs or processes can be merged exactly.
+
+        Attributes:
+            count (int): Number of values added
+            min (float): Smallest value added (None if empty)
+            max (float): Largest value added (None if empty)
+            mean (float): Mean of the values added
+    """
+
+    __slots__ = ('count', 'min', 'max', 'mean', '_m2', '_zero_count', '_bins')
+
+    def __init__(self):
+        """ Initialize an empty QuantileSketch """
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._zero_count = 0
+        self._bins = {}
+
+    def add(self, value):
+        """ Add a value to the sketch.
+
+            Args:
+                value (float): A non-negative value
+        """
+
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        # Welford's online algorithm for the mean and variance
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self._m2 += delta*(value - self.mean)
+
+        if value <= 0:
+            self._zero_count += 1
+            return
+        index = math.ceil(math.log(value)/LOG_GAMMA)
+        bins = self._bins
+        bins[index] = bins.get(index, 0) + 1
+        if len(bins) > MAX_BINS:
+            self._collapse()
+
+    def merge(self, other):
+        """ Add every value summarized by another sketch to this one.
+
+            Args:
+                other (QuantileSketch): The sketch to merge into this one
+        """
+
+        if not other.count:
+            return
+        if not self.count:
+            self.min, self.max = other.min, other.max
+        else:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+        # Chan et al.'s formula for combining the mean and variance of two sets
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta*delta*self.count*other.count/count
+        self.mean += delta*other.count/count
+        self.count = count
+
+        self._zero_count += other._zero_count
+        for index, bin_count in other._bins.items():
+            self._bins[index] = self._bins.get(index, 0) + bin_count
+        if len(self._bins) > MAX_BINS:
+            self._collapse()
+
+    def _collapse(self):
+        """ Merge the lowest bins until at most MAX_BINS remain """
+        indexes = sorted(self._bins)
+        excess = len(indexes) - MAX_BINS
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self._bins[target] += self._bins.pop(index)
+
+    @property
+    def variance(self):
+        """ Population variance of the values added """
+        return self._m2/self.count if self.count else 0.0
+
+    @property
+    def stddev(self):
+        """ Population standard deviation of the values added """
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        """ Estimate a quantile of the values added.
+
+            Args:
+                q (float): The quantile, between 0 and 1 (e.g. 0.95 for the 95th percentile)
+            Returns:
+                float: The estimated quantile, within RELATIVE_ACCURACY of the exact value (None if the sketch is empty)
+        """
+
+        if not self.count:
+            return None
+        rank = q*(self.count - 1)
+
+        if rank < self._zero_count:
+            return max(self.min, 0)
+        seen = self._zero_count
+        for index in sorted(self._bins):
+            seen += self._bins[index]
+            if seen > rank:
+                value = 2*GAMMA**index/(GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """ Summarize the sketch.
+
+            Returns:
+                dict: The count, min, max, mean, standard deviation and the quantiles in SUMMARY_QUANTILES (as 'p50', 'p95', ...)
+        """
+
+        summary = {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean, 'stddev': self.stddev}
+        for q in SUMMARY_QUANTILES:
+            summary['p{:g}'.format(q*100)] = self.quantile(q)
+        return summary
+
+
+# Sketches kept by each MiningTruck and UnloadStation when distributions are enabled
+TRUCK_DISTRIBUTIONS = ('wait_times', 'mining_times', 'cycle_times')
+STATION_DISTRIBUTIONS = ('wait_times', 'queue_lengths')
+
+
+def FleetDistributions(mining_trucks, unload_stations):
+    """ Merge the sketches of every truck and station into fleet-wide sketches.
+
+        Args:
+            mining_trucks (list): MiningTruck instances created with distributions enabled
+            unload_stations (list): UnloadStation instances created with distributions enabled
+        Returns:
+            dict: A merged QuantileSketch for each truck distribution (keyed 'truck_<name>') and station distribution (keyed 'station_<name>')
+    """
+
+    fleet = {}
+    for prefix, entities, names in (('truck', mining_trucks, TRUCK_DISTRIBUTIONS), ('station', unload_stations, STATION_DISTRIBUTIONS)):
+        for name in names:
+            sketch = QuantileSketch()
+            for entity in entities:
+                sketch.merge(getattr(entity, name))
+            fleet['{}_{}'.format(prefix, name)] = sketch
+    return fleet
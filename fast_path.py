@@ -0,0 +1,91 @@
+import array
+import heapq
+import numpy as np
+import constants as const
+from compact_simulation import FleetStore
+from streams import MiningStreams, MaxDraws, UniformDuration, TRUCKS_PER_CHUNK
+
+
+def IsContentionFree(n, m, distribution=None):
+    """ Check whether no truck can ever wait at an unload station.
+        A truck leaves for its next mining operation as soon as it starts unloading, and is back no sooner than the shortest mining time plus the trips to and from the
+        station later. When that is at least UNLOAD_TIME, the truck's unload has completed by the time it is back, so at most n - 1 other trucks occupy a station when a truck
+        arrives. With at least as many stations as trucks there is then always an idle station.
+
+        Args:
+            n (int): Number of mining trucks
+            m (int): Number of unload stations
+            distribution (instance): Distribution of mining times (see streams.py); defaults to uniform between 1 and 5 hours
+        Returns:
+            bool: True if the configuration is contention-free
+    """
+
+    minimum = (UniformDuration() if distribution is None else distribution).minimum
+    return m >= n and const.UNLOAD_TIME <= minimum + 2*const.TRAVEL_TIME
+
+def _ToArray(values):
+    """ Convert a NumPy array to the typed array used by FleetStore """
+    return array.array('q', values.astype(np.int64).tobytes())
+
+def RunContentionFreeSimulation(n, m, horizon=None, seed=None, distribution=None):
+    """ Run the simulation of a contention-free configuration (see IsContentionFree) without the task queue.
+        Since no truck ever waits, every truck's trajectory only depends on its own mining times: every mining time a truck can draw before the horizon is sampled at once,
+        so the trips and unloads that fall before the horizon are counted from it with NumPy. Stations are then assigned to the arrivals in time order the same way as RunSimulation
+        (the idle station with the lowest id).
+
+        The trucks' statistics are identical to the other engines for the same seed. Stations are assigned by truck id when several trucks arrive at the same time, which can differ
+        from the order RunSimulation performs them in, so the stations' statistics follow the same distribution but may differ slightly.
+
+        Args:
+            n (int): Number of mining trucks in the simulation.
+            m (int): Number of unload stations in the simulation; must be at least n.
+            horizon (int): Time (in seconds) to run the simulation up to; defaults to TOTAL_SIM_TIME.
+            seed (int): Master seed of the trucks' mining time streams (see MiningStreams); defaults to one drawn from the random module.
+            distribution (instance): Distribution of mining times (see streams.py); defaults to uniform between 1 and 5 hours.
+        Returns:
+            tuple (list, list): MiningTruckView and UnloadStationView instances for every truck and station
+    """
+
+    if not IsContentionFree(n, m, distribution):
+        raise ValueError("{} trucks and {} stations is not a contention-free configuration".format(n, m))
+    if horizon is None:
+        horizon = const.TOTAL_SIM_TIME
+
+    # Sample every mining operation that can start before the horizon; the streams are only sampled, so no truck needs a buffer
+    streams = MiningStreams(0, seed, distribution)
+    cycles = MaxDraws(horizon, streams.distribution)
+    mining_time = np.concatenate([streams.sample(first, min(first + TRUCKS_PER_CHUNK, n), cycles) for first in range(0, n, TRUCKS_PER_CHUNK)])
+
+    start_mining = np.zeros((n, cycles), dtype=np.int64)
+    np.cumsum(mining_time[:, :-1] + 2*const.TRAVEL_TIME, axis=1, out=start_mining[:, 1:])
+    end_mining = start_mining + mining_time
+    arrival = end_mining + const.TRAVEL_TIME
+
+    # Only count the tasks performed before the horizon. A truck heads back to a mining location as soon as it arrives, since it never waits.
+    mined = start_mining <= horizon
+    arrived = arrival <= horizon
+    unloaded = arrival + const.UNLOAD_TIME <= horizon
+
+    store = FleetStore(n, m)
+    store.total_times_mined = _ToArray(mined.sum(axis=1))
+    store.time_spent_mining = _ToArray(np.where(mined, mining_time, 0).sum(axis=1))
+    store.times_traveled = _ToArray((end_mining <= horizon).sum(axis=1) + arrived.sum(axis=1))
+    store.total_unloads = _ToArray(unloaded.sum(axis=1))
+
+    # Assign stations to the arrivals in time order (by truck id on ties): the idle station with the lowest id
+    trucks, _ = np.nonzero(arrived)
+    times = arrival[arrived]
+    order = np.lexsort((trucks, times))
+
+    station_total_unloads = store.station_total_unloads
+    idle = list(range(m))
+    busy = []
+    for time in times[order].tolist():
+        while busy and busy[0][0] <= time:
+            heapq.heappush(idle, heapq.heappop(busy)[1])
+        station = heapq.heappop(idle)
+        heapq.heappush(busy, (time + const.UNLOAD_TIME, station))
+        if time + const.UNLOAD_TIME <= horizon:
+            station_total_unloads[station] += 1
+
+    return store.trucks(), store.stations()
@@ -0,0 +1,166 @@
+import collections
+import json
+import time as timer
+
+
+def Bucket(value):
+    """ Return the power of two histogram bucket a value falls in: 0, 1, 2, 4, 8, ... (the smallest power of two greater than or equal to the value) """
+    return 0 if value <= 0 else 1 << (value - 1).bit_length()
+
+
+class Instrumentation():
+    """ Collects counters and histograms from the event loop of a simulation. Pass an instance to RunSimulation to enable it; when no instance is passed the event loop runs
+        without any instrumentation. The hook methods (taskPerformed, taskScheduled, stationSelected) can be overridden to observe the simulation as it runs.
+
+        Attributes:
+            task_counts (Counter): Number of tasks performed, by task name
+            scheduling_calls (int): Number of calls to the task queue (enqueue and getCurrentTask)
+            scheduling_time (float): Wall time in seconds spent in the task queue
+            selections (int): Number of unload stations selected
+            selection_time (float): Wall time in seconds spent selecting unload stations
+            wall_time (float): Wall time in seconds of the event loop, including scheduling the trucks' initial tasks
+            peak_queue_depth (int): Largest number of tasks in the task queue
+            queue_depth_histogram (Counter): Number of enqueues by the task queue's depth afterwards, in power of two buckets (see Bucket)
+            station_queue_histogram (Counter): Number of trucks already queued at the station each arriving truck was sent to
+    """
+
+    def __init__(self):
+        """ Initialize an Instrumentation with every counter set to zero """
+
+        self.task_counts = collections.Counter()
+        self.scheduling_calls = 0
+        self.scheduling_time = 0.0
+        self.selections = 0
+        self.selection_time = 0.0
+        self.wall_time = 0.0
+        self.peak_queue_depth = 0
+        self.queue_depth_histogram = collections.Counter()
+        self.station_queue_histogram = collections.Counter()
+        self._start = None
+
+    def start(self):
+        """ Mark the start of the event loop, before the trucks' initial tasks are scheduled """
+        self._start = timer.perf_counter()
+
+    def stop(self):
+        """ Mark the end of the event loop """
+        self.wall_time += timer.perf_counter() - self._start
+
+    def taskPerformed(self, name, time):
+        """ Hook called for every task performed by the simulation.
+
+            Args:
+                name (str): Name of the task, e.g. 'startMining'
+                time (int): Simulation time at which the task was performed
+        """
+        self.task_counts[name] += 1
+
+    def taskScheduled(self, seconds, depth):
+        """ Hook called for every task added to the task queue.
+
+            Args:
+                seconds (float): Wall time the enqueue took
+                depth (int): Number of tasks in the queue afterwards
+        """
+        if depth > self.peak_queue_depth:
+            self.peak_queue_depth = depth
+        self.queue_depth_histogram[Bucket(depth)] += 1
+
+    def stationSelected(self, seconds, station):
+        """ Hook called every time an unload station is selected for an arriving truck.
+
+            Args:
+                seconds (float): Wall time the selection took
+                station (instance): The selected UnloadStation, before the truck is queued at it
+        """
+        self.selections += 1
+        self.selection_time += seconds
+        self.station_queue_histogram[len(station.truck_queue)] += 1
+
+    def report(self):
+        """ Build a machine-readable report of the collected counters.
+
+            Returns:
+                dict: Tasks performed (in total, per second and by name), wall time split between scheduling, station selection and dispatch (everything else in the event loop),
+                      the peak task queue depth and the histograms
+        """
+
+        tasks = sum(self.task_counts.values())
+        return {
+            'tasks': tasks,
+            'tasks_per_second': tasks/self.wall_time if self.wall_time else 0,
+            'tasks_by_name': dict(sorted(self.task_counts.items())),
+            'wall_time': self.wall_time,
+            'time': {
+                'scheduling': self.scheduling_time,
+                'station_selection': self.selection_time,
+                'dispatch': max(self.wall_time - self.scheduling_time - self.selection_time, 0),
+            },
+            'scheduling_calls': self.scheduling_calls,
+            'station_selections': self.selections,
+            'peak_queue_depth': self.peak_queue_depth,
+            'queue_depth_histogram': {str(bucket): count for bucket, count in sorted(self.queue_depth_histogram.items())},
+            'station_queue_length_histogram': {str(length): count for length, count in sorted(self.station_queue_histogram.items())},
+        }
+
+    def write(self, path):
+        """ Write the report to a JSON file, or to stdout if path is '-' """
+
+        report = json.dumps(self.report(), indent=2)
+        if path == '-':
+            print(report)
+        else:
+            with open(path, 'w') as f:
+                f.write(report + '\n')
+
+
+class InstrumentedTaskQueue():
+    """ Wraps a task queue (TaskQueue or HeapTaskQueue) and reports every call to an Instrumentation.
+        A task is counted as performed when the next task is retrieved, so the task that ends the simulation by passing its horizon isn't counted.
+    """
+
+    def __init__(self, task_queue, instrumentation):
+        self.task_queue = task_queue
+        self.instrumentation = instrumentation
+        self._last_task = None
+
+    @property
+    def queue(self):
+        return self.task_queue.queue
+
+    def enqueue(self, *args):
+        start = timer.perf_counter()
+        self.task_queue.enqueue(*args)
+        seconds = timer.perf_counter() - start
+
+        self.instrumentation.scheduling_calls += 1
+        self.instrumentation.scheduling_time += seconds
+        self.instrumentation.taskScheduled(seconds, len(self.task_queue.queue))
+
+    def getCurrentTask(self):
+        start = timer.perf_counter()
+        task = self.task_queue.getCurrentTask()
+        self.instrumentation.scheduling_calls += 1
+        self.instrumentation.scheduling_time += timer.perf_counter() - start
+
+        if self._last_task is not None:
+            self.instrumentation.taskPerformed(self._last_task[0].__name__, self._last_task[1])
+        self._last_task = task
+        return task
+
+
+class InstrumentedStationIndex():
+    """ Wraps an UnloadStationIndex and reports every station selection to an Instrumentation """
+
+    def __init__(self, station_index, instrumentation):
+        self.station_index = station_index
+        self.instrumentation = instrumentation
+
+    def update(self, station):
+        self.station_index.update(station)
+
+    def getNextUnloadStation(self, cur_time):
+        start = timer.perf_counter()
+        station = self.station_index.getNextUnloadStation(cur_time)
+        self.instrumentation.stationSelected(timer.perf_counter() - start, station)
+        return station
@@ -0,0 +1,177 @@
+import array
+import csv
+import heapq
+import json
+import struct
+import sys
+
+# Fields written for each truck and station by WriteEntities
+TRUCK_FIELDS = ('id', 'total_unloads', 'total_times_mined', 'time_spent_mining', 'time_spent_waiting', 'times_traveled')
+STATION_FIELDS = ('id', 'total_unloads', 'time_spent_waiting')
+
+# Output formats supported by WriteEntities, by file extension
+OUTPUT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.col': 'columnar'}
+
+# Columnar files start with this line, followed by a JSON line listing the columns, then blocks of up to COLUMNAR_BLOCK_SIZE rows.
+# Each block is the number of rows (unsigned 32 bit, little endian) followed by each column's values as signed 64 bit integers (little endian).
+COLUMNAR_MAGIC = b'H3COLUMNS 1\n'
+COLUMNAR_BLOCK_SIZE = 65536
+
+
+def FormatDuration(seconds):
+    """ Format a duration in seconds as hours, minutes and seconds, e.g. '1h 05m 09s'. Fractions of a second are dropped. """
+    seconds = int(seconds)
+    return "{}h {:02d}m {:02d}s".format(seconds//3600, seconds%3600//60, seconds%60)
+
+def TruckSortKey(truck):
+    """ Sort key for trucks, in increasing order of performance: fewest unloads, then highest average mining time """
+    return (truck.total_unloads, -truck.time_spent_mining/truck.total_times_mined)
+
+def StationSortKey(station):
+    """ Sort key for stations, in increasing order of performance: fewest unloads, then highest total waiting time """
+    return (station.total_unloads, -station.time_spent_waiting)
+
+def SelectEntities(entities, key, top=None, bottom=None):
+    """ Select the best and/or worst performing entities, ordered from best to worst. Uses partial selection, so only the selected entities are sorted.
+
+        Args:
+            entities (iterable): Trucks or stations
+            key (func): Sort key in increasing order of performance, e.g. TruckSortKey
+            top (int): Number of best performing entities to select
+            bottom (int): Number of worst performing entities to select
+        Returns:
+            list: Every entity sorted from best to worst if neither top nor bottom is given; otherwise the top entities followed by the bottom entities.
+                  An entity is only included once if the top and bottom overlap.
+    """
+
+    if top is None and bottom is None:
+        return sorted(entities, key=key, reverse=True)
+
+    entities = list(entities)
+    selected = heapq.nlargest(top, entities, key=key) if top else []
+    if bottom:
+        chosen = set(map(id, selected))
+        selected += [entity for entity in reversed(heapq.nsmallest(bottom, entities, key=key)) if id(entity) not in chosen]
+    return selected
+
+def FormatTruckRow(truck):
+    """ Format a row of the mining truck table displayed by DisplayStatistics """
+    return "{id:>8d} | {tmt:>17s} | {amt:>19s} | {tu:>13d} | {tsw:>18s}".format(
+        id=truck.id, tmt=FormatDuration(truck.time_spent_mining), amt=FormatDuration(truck.time_spent_mining/truck.total_times_mined),
+        tu=truck.total_unloads, tsw=FormatDuration(truck.time_spent_waiting))
+
+def FormatStationRow(station):
+    """ Format a row of the unload station table displayed by DisplayStatistics """
+    average_waiting_time = 0 if not station.total_unloads else station.time_spent_waiting/station.total_unloads
+    return "{id:>10d} | {tup:>13d} | {tttw:>24s} | {atwt:>27s}".format(
+        id=station.id, tup=station.total_unloads, tttw=FormatDuration(station.time_spent_waiting), atwt=FormatDuration(average_waiting_time))
+
+def OutputFormat(path, format=None):
+    """ Return the output format for a path: the given format, otherwise the one matching the path's extension (see OUTPUT_FORMATS) """
+
+    if format:
+        return format
+    for extension, extension_format in OUTPUT_FORMATS.items():
+        if path.endswith(extension):
+            return extension_format
+    raise ValueError("Can't tell the output format of '{}'; use one of the extensions {} or pass a format".format(path, ', '.join(OUTPUT_FORMATS)))
+
+def WriteEntities(path, entities, fields, format=None):
+    """ Stream the statistics of every truck or station to a file, one entity at a time so memory use doesn't grow with the number of entities.
+
+        Args:
+            path (str): Path of the file to write
+            entities (iterable): Trucks or stations
+            fields (tuple): Attributes to write for each entity, e.g. TRUCK_FIELDS
+            format (str): 'csv', 'jsonl' or 'columnar'; defaults to the format matching the path's extension
+        Returns:
+            int: Number of entities written
+    """
+    return WriteRows(path, ([getattr(entity, field) for field in fields] for entity in entities), fields, format)
+
+def WriteRows(path, rows, fields, format=None):
+    """ Stream rows of integers to a file, one row at a time. See WriteEntities.
+
+        Args:
+            path (str): Path of the file to write
+            rows (iterable): Sequences with a value for each field
+            fields (tuple): Names of the columns
+            format (str): 'csv', 'jsonl' or 'columnar'; defaults to the format matching the path's extension
+        Returns:
+            int: Number of rows written
+    """
+
+    format = OutputFormat(path, format)
+    count = 0
+
+    if format == 'csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+
+    elif format == 'jsonl':
+        with open(path, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(fields, row))) + '\n')
+                count += 1
+
+    elif format == 'columnar':
+        with open(path, 'wb') as f:
+            f.write(COLUMNAR_MAGIC)
+            f.write(json.dumps({'columns': list(fields)}).encode() + b'\n')
+
+            columns = [array.array('q') for _ in fields]
+            for row in rows:
+                for column, value in zip(columns, row):
+                    column.append(value)
+                count += 1
+                if len(columns[0]) == COLUMNAR_BLOCK_SIZE:
+                    _WriteColumnarBlock(f, columns)
+            if len(columns[0]):
+                _WriteColumnarBlock(f, columns)
+
+    else:
+        raise ValueError("Unknown output format '{}'".format(format))
+
+    return count
+
+def _WriteColumnarBlock(f, columns):
+    """ Write a block of rows to a columnar file and empty the columns """
+
+    f.write(struct.pack('<I', len(columns[0])))
+    for column in columns:
+        if sys.byteorder == 'big':
+            column.byteswap()
+        f.write(column.tobytes())
+        del column[:]
+
+def ReadColumnar(path):
+    """ Read a file written by WriteEntities or WriteRows in the columnar format.
+
+        Args:
+            path (str): Path of the file to read
+        Returns:
+            dict: An array of values for each column, keyed by field name
+    """
+
+    with open(path, 'rb') as f:
+        if f.readline() != COLUMNAR_MAGIC:
+            raise ValueError("'{}' is not a columnar statistics file".format(path))
+        fields = json.loads(f.readline())['columns']
+        columns = {field: array.array('q') for field in fields}
+
+        while True:
+            header = f.read(4)
+            if not header:
+                break
+            (rows,) = struct.unpack('<I', header)
+            for field in fields:
+                columns[field].frombytes(f.read(8*rows))
+
+    if sys.byteorder == 'big':
+        for column in columns.values():
+            column.byteswap()
+    return columns
@@ -0,0 +1,207 @@
+import array
+import hashlib
+import json
+import os
+import sys
+import constants as const
+from compact_simulation import FleetStore, StoreEntities
+
+# Part of every cache key. Increase it whenever a change to the engines changes the results of the same configuration and seed, so stale results are never returned.
+ENGINE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'helium3-simulation')
+# Least recently used results are evicted once the cache grows past this many bytes
+DEFAULT_MAX_BYTES = 256*1024*1024
+
+# Cached results start with this line, followed by a JSON line holding the configuration and the length of every FleetStore array,
+# then the arrays' little-endian contents in FleetStore.__slots__ order. Unlike a pickle, reading a file from a shared cache can't run code.
+CACHE_MAGIC = b'H3CACHE 1\n'
+CACHE_EXTENSION = '.h3cache'
+
+
+def CacheKey(n, m, seed, horizon=None, fast_path=False):
+    """ Build the configuration a cached result is stored under: everything that determines the results of a run with the default mining time distribution.
+        The engine and scheduler aren't part of the key since they all produce identical results; whether the fast path was used is, since its stations' statistics can differ.
+
+        Args:
+            n (int): Number of mining trucks
+            m (int): Number of unload stations
+            seed (int): Master seed of the trucks' mining time streams
+            horizon (int): Time (in seconds) the simulation is run up to; defaults to TOTAL_SIM_TIME
+            fast_path (bool): Whether the run uses the contention-free fast path
+        Returns:
+            dict: The configuration, including the simulation constants and ENGINE_VERSION
+    """
+
+    return {
+        'trucks': n,
+        'stations': m,
+        'seed': seed,
+        'horizon': const.TOTAL_SIM_TIME if horizon is None else horizon,
+        'fast_path': fast_path,
+        'total_sim_time': const.TOTAL_SIM_TIME,
+        'travel_time': const.TRAVEL_TIME,
+        'unload_time': const.UNLOAD_TIME,
+        'engine_version': ENGINE_VERSION,
+    }
+
+
+def _WriteStore(f, key, store):
+    """ Write a configuration and its FleetStore to a binary file (see CACHE_MAGIC) """
+
+    f.write(CACHE_MAGIC)
+    lengths = {name: len(getattr(store, name)) for name in FleetStore.__slots__}
+    f.write(json.dumps({'key': key, 'lengths': lengths}, sort_keys=True).encode() + b'\n')
+    for name in FleetStore.__slots__:
+        values = getattr(store, name)
+        if sys.byteorder == 'big':
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        f.write(values.tobytes())
+
+def _ReadStore(f):
+    """ Read a configuration and its FleetStore written by _WriteStore, raising ValueError if the file isn't a complete cached result """
+
+    if f.readline() != CACHE_MAGIC:
+        raise ValueError("Not a cached result")
+    header = json.loads(f.readline())
+    store = FleetStore(0, 0)
+    for name in FleetStore.__slots__:
+        values = getattr(store, name)
+        length = header['lengths'][name]
+        if not isinstance(length, int) or length < 0:
+            raise ValueError("Invalid length for {}".format(name))
+        data = f.read(values.itemsize*length)
+        if len(data) != values.itemsize*length:
+            raise ValueError("Truncated cached result")
+        values.frombytes(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+    if f.read(1):
+        raise ValueError("Unexpected data after the cached result")
+    return header['key'], store
+
+
+class ResultCache():
+    """ Content-addressed cache of simulation results on disk. Each result is a file named after the SHA-256 hash of its configuration (see CacheKey),
+        holding the configuration and a FleetStore of every truck's and station's statistics (see CACHE_MAGIC). A file that can't be decoded is treated as a miss.
+
+        Several processes can share a cache: results are written to a temporary file and moved into place, so readers only ever see complete files,
+        and files removed by another process are treated as misses. Reading a result updates its modification time, which eviction uses to remove
+        the least recently used results once the cache is larger than max_bytes.
+
+        Attributes:
+            directory (str): Directory the results are stored in
+            max_bytes (int): Size the cache is trimmed to after every write
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        """ Return the path of the file a configuration is stored in """
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.directory, digest + CACHE_EXTENSION)
+
+    def get(self, key):
+        """ Look up the result of a configuration.
+
+            Args:
+                key (dict): The configuration, see CacheKey
+            Returns:
+                tuple (list, list): Views of every truck and station (see FleetStore), or None if the result isn't cached
+        """
+
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, store = _ReadStore(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError, KeyError, AttributeError):
+            # A file that can't be decoded is removed so it's written again
+            self._remove(path)
+            return None
+
+        if stored_key != key:
+            return None
+        return store.trucks(), store.stations()
+
+    def put(self, key, mining_trucks, unload_stations):
+        """ Store the result of a configuration, then evict the least recently used results if the cache is too large.
+
+            Args:
+                key (dict): The configuration, see CacheKey
+                mining_trucks (list): Mining trucks returned by RunSimulation
+                unload_stations (list): Unload stations returned by RunSimulation
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            _WriteStore(f, key, StoreEntities(mining_trucks, unload_stations))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def _entries(self):
+        """ Return (modification time, size, path) of every cached result """
+
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        """ Remove a file, ignoring files another process already removed """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        """ Return the total size in bytes of the cached results """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """ Remove the least recently used results until the cache is no larger than max_bytes.
+
+            Returns:
+                int: Number of results removed
+        """
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """ Remove every cached result.
+
+            Returns:
+                int: Number of results removed
+        """
+
+        entries = self._entries()
+        for _, _, path in entries:
+            self._remove(path)
+        return len(entries)
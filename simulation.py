@@ -1,8 +1,22 @@
 import argparse
-import random
-import datetime
+import collections
+import heapq
+import itertools
 import sys
 import constants as const
+from compact_simulation import RunCompactSimulation, CompactSimulation
+from instrumentation import Instrumentation, InstrumentedTaskQueue, InstrumentedStationIndex
+from fast_path import IsContentionFree, RunContentionFreeSimulation
+from streams import MiningStreams
+from telemetry import Telemetry, TelemetryTaskQueue, DEFAULT_INTERVAL
+from distributions import QuantileSketch, FleetDistributions
+from result_cache import ResultCache, CacheKey, DEFAULT_CACHE_DIR
+from report import FormatDuration, SelectEntities, TruckSortKey, StationSortKey, FormatTruckRow, FormatStationRow, WriteEntities, TRUCK_FIELDS, STATION_FIELDS, OUTPUT_FORMATS
+
+# Priorities used by the HeapTaskQueue to order tasks scheduled for the same time. Lower values run first.
+# Unload completions run before any other task at the same time so stations are cleared before trucks arrive.
+TASK_PRIORITY_UNLOAD_COMPLETE = 0
+TASK_PRIORITY_DEFAULT = 1
 
 class MiningTruck():
     """ Represents a mining truck that continuously performs the following work flow:
@@ -17,12 +31,22 @@ class MiningTruck():
             time_spent_waiting (int): Total time in seconds this truck spent waiting at an unload station (in the event all stations were in use when the truck arrived)
             time_spent_mining (int): Total time in seconds this truck spent mining at mining locations
             times_traveled (int): Total number of times this truck traveled between mining locations and the unload station
+            wait_times (QuantileSketch): Distribution of the time spent waiting at each unload (None unless distributions are enabled)
+            mining_times (QuantileSketch): Distribution of the duration of each mining operation (None unless distributions are enabled)
+            cycle_times (QuantileSketch): Distribution of the time from the start of one mining operation to the start of the next (None unless distributions are enabled)
+            streams (MiningStreams): The mining time streams this truck draws from, at index stream
     """
 
-    def __init__(self, id, task_queue):
-        """ Initialize a MiningTruck """
+    def __init__(self, id, task_queue, distributions=False, streams=None):
+        """ Initialize a MiningTruck. With distributions enabled, the truck also keeps fixed-size sketches of its waiting, mining and cycle times.
+            Trucks of a simulation share the fleet's MiningStreams and draw from the stream at index id - 1; a truck created without streams gets a stream of its own.
+        """
         
         self.id = id
+        if streams is None:
+            self.streams, self.stream = MiningStreams(1), 0
+        else:
+            self.streams, self.stream = streams, id - 1
 
         # Each truck starts the simulation at a mining location - add a mining task to the 'task queue' upon the instantiation of a MiningTruck
         task_queue.enqueue((self.startMining, 0))
@@ -34,6 +58,11 @@ class MiningTruck():
         self.time_spent_mining = 0
         self.times_traveled = 0
 
+        self.wait_times = QuantileSketch() if distributions else None
+        self.mining_times = QuantileSketch() if distributions else None
+        self.cycle_times = QuantileSketch() if distributions else None
+        self.last_mining_start = None
+
     def goToMiningLocation(self, cur_time):
         """ Travel to a mining location from the unload station.
 
@@ -61,7 +90,7 @@ class MiningTruck():
         return((self.unload, cur_time + const.TRAVEL_TIME))
     
     def startMining(self, cur_time):
-        """ Start the mining process for this truck. Mining time is a random time in seconds between 1 and 5 hours.
+        """ Start the mining process for this truck. Mining time is drawn from this truck's stream, by default a random time in seconds between 1 and 5 hours.
 
             Args:
                 cur_time (int): Time at which the truck begins the mining operation
@@ -69,12 +98,18 @@ class MiningTruck():
                 tuple (func, int): Tuple containing this truck's next task, and the time the task should be executed. This tuple will be added to the simulation's task queue.
         """
 
-        # Get a random time between 1 and 5 hours in seconds, representing the amount of time this truck will spend mining
-        mining_time = random.randint(3600, 18000)
+        # Get the next mining time of this truck's stream (by default between 1 and 5 hours in seconds), representing the amount of time this truck will spend mining
+        mining_time = self.streams.draw(self.stream)
         
         self.time_spent_mining += mining_time
         self.total_times_mined += 1
 
+        if self.mining_times is not None:
+            self.mining_times.add(mining_time)
+            if self.last_mining_start is not None:
+                self.cycle_times.add(cur_time - self.last_mining_start)
+            self.last_mining_start = cur_time
+
         return((self.goToUnloadStation, cur_time + mining_time))
     
     def unload(self, cur_time, station):
@@ -89,6 +124,8 @@ class MiningTruck():
 
         queue_time = station.queueTime(cur_time)
         self.time_spent_waiting += queue_time
+        if self.wait_times is not None:
+            self.wait_times.add(queue_time)
        
         station.enqueue(self, cur_time)
         return (self.goToMiningLocation, cur_time + queue_time)
@@ -103,20 +140,27 @@ class UnloadStation():
             time_spent_waiting (int): Total time in seconds this truck spent waiting at an unload station (in the event all stations were in use when the truck arrived)
             time_spent_mining (int): Total time in seconds this truck spent mining at mining locations
             times_traveled (int): Total number of times this truck traveled between mining locations and the unload station
+            wait_times (QuantileSketch): Distribution of the time each truck queued at this station waited (None unless distributions are enabled)
+            queue_lengths (QuantileSketch): Distribution of the number of trucks already at the station when each truck arrived (None unless distributions are enabled)
     """
 
-    def __init__(self, id):
-        """ Initialize an UnloadStation """
+    def __init__(self, id, distributions=False):
+        """ Initialize an UnloadStation. With distributions enabled, the station also keeps fixed-size sketches of waiting times and queue lengths. """
 
         self.id = id
-        # This list contains the starting times for each truck currently at the station
-        self.truck_queue = []
+        # This deque contains the starting times for each truck currently at the station
+        self.truck_queue = collections.deque()
         # The start time of the truck currently unloading at the station
         self.start_time = None
+        # The time at which the last truck in the queue finishes unloading (the station is free from this time on)
+        self.tail_free_time = 0
     
         # Variables for tracking unload station statistics throughout the simulation
         self.time_spent_waiting = 0
         self.total_unloads = 0
+
+        self.wait_times = QuantileSketch() if distributions else None
+        self.queue_lengths = QuantileSketch() if distributions else None
     
     def inUse(self):
         """ Check if this station is occupied by another truck unloading Helium-3.
@@ -135,7 +179,7 @@ class UnloadStation():
         """
         if not self.inUse():
             return 0
-        return len(self.truck_queue)*const.UNLOAD_TIME - (cur_time - self.start_time)
+        return self.tail_free_time - cur_time
 
     def enqueue(self, truck, cur_time):
         """ Add truck to the queue for this station. A truck being in the station's queue does not mean it's waiting. The first truck in the queue is the truck currently unloading.
@@ -146,11 +190,15 @@ class UnloadStation():
         """
         queue_time = self.queueTime(cur_time)
         self.time_spent_waiting += queue_time
+        if self.wait_times is not None:
+            self.wait_times.add(queue_time)
+            self.queue_lengths.add(len(self.truck_queue))
 
         if not self.inUse():
             self.start_time = cur_time
    
         self.truck_queue.append((truck, cur_time+queue_time))
+        self.tail_free_time = cur_time + queue_time + const.UNLOAD_TIME
     
     def startNextUnload(self, cur_time):
         """ After the completion of an unload process, start the unload process for the next mining truck in this station's queue.
@@ -161,9 +209,8 @@ class UnloadStation():
         
         self.total_unloads += 1
 
-        self.truck_queue[0][0].total_unloads += 1
-
-        self.truck_queue = self.truck_queue[1:]
+        truck, _ = self.truck_queue.popleft()
+        truck.total_unloads += 1
 
         if len(self.truck_queue):
             self.start_time = self.truck_queue[0][1]
@@ -186,11 +233,12 @@ class TaskQueue():
         """ Initialize a TaskQueue """
         self.queue = []
     
-    def enqueue(self, task):
+    def enqueue(self, task, priority=None):
         """ Insert a task into the queue. Tasks are inserted based off the time they will be performed.
            
             Args:
                 task (tuple): tuple containing a task(func) and the time the task should be performed (int)
+                priority (int): Unused; accepted for compatibility with HeapTaskQueue. This queue derives priority from the task's name.
         """
 
         func, time = task
@@ -220,6 +268,117 @@ class TaskQueue():
         self.queue = self.queue[1:]
         return nextTask
 
+
+class HeapTaskQueue():
+    """ Binary heap implementation of the TaskQueue. Enqueue and getCurrentTask are O(log n) rather than O(n), which keeps large fleets from slowing the simulation down quadratically.
+
+        Each heap entry is a tuple of (time, priority, sequence number, task). Tasks are ordered by time, then by priority (see TASK_PRIORITY_*), then in the order they were enqueued.
+        This produces the same execution order as TaskQueue: tasks at the same time run first-in first-out, except unload completions which run before everything else at that time.
+        (TaskQueue orders simultaneous unload completions last-in first-out; they always belong to different stations and don't depend on each other, so results are identical.)
+
+        Attributes:
+            queue (list): Heap of (time, priority, sequence number, task) tuples
+    """
+
+    def __init__(self):
+        """ Initialize a HeapTaskQueue """
+        self.queue = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def enqueue(self, task, priority=TASK_PRIORITY_DEFAULT):
+        """ Insert a task into the queue.
+
+            Args:
+                task (tuple): tuple containing a task(func) and the time the task should be performed (int)
+                priority (int): Priority of the task relative to other tasks performed at the same time. Lower values run first.
+        """
+
+        func, time = task
+        heapq.heappush(self.queue, (time, priority, next(self._counter), func))
+
+    def getCurrentTask(self):
+        """ Retrieve the next task that should be performed and remove it from the queue.
+
+            Returns:
+                tuple(func, int): Tuple containing the next task and it's time
+        """
+
+        time, _, _, func = heapq.heappop(self.queue)
+        return (func, time)
+
+
+# Task queue implementations that can be selected when running the simulation
+SCHEDULERS = {
+    'list': TaskQueue,
+    'heap': HeapTaskQueue,
+}
+
+# Simulation engines that can be selected when running the simulation (see RunSimulation)
+ENGINES = ('object', 'compact', 'coalesced')
+
+class UnloadStationIndex():
+    """ Index over the unload stations used to find the station with the lowest waiting time without scanning every station.
+        Returns the same station as GetNextUnloadStation: the idle station with the lowest id, otherwise the busy station that frees up first (lowest id on ties).
+
+        Idle stations are kept in a heap of ids and busy stations in a heap of (tail_free_time, id). Entries are invalidated lazily; an entry is only acted on if it still matches the station's state.
+        A busy station whose tail_free_time has passed is idle, since unload completions run before any other task at the same time.
+        Call update(station) after a truck is enqueued at a station.
+
+        Attributes:
+            stations (dict): UnloadStation instances keyed by id
+    """
+
+    def __init__(self, stations):
+        """ Initialize an UnloadStationIndex with all stations idle """
+        self.stations = {station.id: station for station in stations}
+        self._idle = [station.id for station in stations if not station.inUse()]
+        heapq.heapify(self._idle)
+        self._busy = [(station.tail_free_time, station.id) for station in stations if station.inUse()]
+        heapq.heapify(self._busy)
+
+    def update(self, station):
+        """ Record a change to a station's queue. Must be called after a truck is enqueued at the station.
+
+            Args:
+                station (instance): The UnloadStation instance whose queue changed
+        """
+        heapq.heappush(self._busy, (station.tail_free_time, station.id))
+
+    def getNextUnloadStation(self, cur_time):
+        """ Return the unload station with the current lowest waiting time.
+
+            Args:
+                cur_time (int): Time (in seconds) at which the truck is trying to unload at a station
+
+            Returns:
+                The UnloadStation instance with the current lowest waiting time
+        """
+
+        busy = self._busy
+        idle = self._idle
+
+        # Move stations that have finished unloading every truck in their queue to the idle heap, discarding stale entries
+        while busy and busy[0][0] <= cur_time:
+            tail_free_time, id = heapq.heappop(busy)
+            if self.stations[id].tail_free_time == tail_free_time:
+                heapq.heappush(idle, id)
+
+        # Return the idle station with the lowest id
+        if idle:
+            return self.stations[heapq.heappop(idle)]
+
+        # All stations are in use, return the station that frees up first
+        while True:
+            tail_free_time, id = busy[0]
+            station = self.stations[id]
+            if station.tail_free_time == tail_free_time:
+                return station
+            heapq.heappop(busy)
+
+
 def GetNextUnloadStation(stations, cur_time):
     """ Return the unload station with the current lowest waiting time.
 
@@ -250,30 +409,205 @@ def GetNextUnloadStation(stations, cur_time):
     # Since loop broke, all stations are currently in use, return the station with the lowest waiting time
     return mnStation
 
-def ParseArgs():
+def ParseRange(value):
+    """ Parse a range of integers given on the command line as 'start:stop' or 'start:stop:step' (stop is inclusive), or a single integer.
+
+        Args:
+            value (str): The range to parse
+        Returns:
+            range: The integers in the range
+    """
+
+    try:
+        parts = [int(part) for part in value.split(':')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid range '{}', expected start:stop[:step]".format(value))
+
+    if len(parts) == 1:
+        parts = parts*2
+    if len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] < 1):
+        raise argparse.ArgumentTypeError("invalid range '{}', expected start:stop[:step]".format(value))
+
+    start, stop = parts[:2]
+    step = parts[2] if len(parts) == 3 else 1
+    return range(start, stop+1, step)
+
+def ParseTarget(value):
+    """ Parse a precision target given on the command line as 'metric=precision', e.g. 'unloads_per_truck=0.01' for a confidence interval within 1% of the estimate.
+
+        Args:
+            value (str): The target to parse
+        Returns:
+            tuple (str, float): The metric and its relative precision
+    """
+
+    metric, _, precision = value.partition('=')
+    try:
+        precision = float(precision)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid target '{}', expected metric=precision".format(value))
+    if not metric or precision <= 0:
+        raise argparse.ArgumentTypeError("invalid target '{}', expected metric=precision with a positive precision".format(value))
+    return metric, precision
+
+def ParseSite(value):
+    """ Parse a site given as 'trucks:stations', e.g. '40:3'.
+
+        Args:
+            value (str): The site's number of mining trucks and unload stations
+        Returns:
+            tuple (int, int): The number of trucks and stations
+    """
+
+    try:
+        n, m = (int(part) for part in value.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid site '{}', expected trucks:stations".format(value))
+    if n < 1 or m < 1:
+        raise argparse.ArgumentTypeError("invalid site '{}', a site needs at least one truck and one station".format(value))
+    return n, m
+
+def ParseArgs(argv=None):
     """ Parse arguments using the argparse module for the number of mining trucks (n) and number of unload stations (m).
-        Both arguments are required and are non-positional, keyword arguments. """
+        Both arguments are required and are non-positional, keyword arguments. The task scheduler (--scheduler) is optional and defaults to 'heap'.
+        The 'sweep' subcommand instead takes ranges of trucks and stations (see ParseRange) and runs the simulation for every combination, either a fixed number of times
+        or until the targets given with --target (see ParseTarget) are met.
+        The 'sites' subcommand takes the trucks and stations of several independent sites (see ParseSite) and runs each site in its own process. """
 
     parser = argparse.ArgumentParser(description='Get number of mining trucks and unload station')
-    parser.add_argument('-n', '--numTrucks', type=int, help='Number of mining trucks', required=True)
-    parser.add_argument('-m', '--unloadStations', type=int, help='Number of unload stations', required=True)
-    args = parser.parse_args()
+    parser.add_argument('-n', '--numTrucks', type=int, help='Number of mining trucks')
+    parser.add_argument('-m', '--unloadStations', type=int, help='Number of unload stations')
+    parser.add_argument('--scheduler', choices=sorted(SCHEDULERS), default='heap', help='Task queue implementation used to schedule tasks')
+    parser.add_argument('--engine', choices=ENGINES, default='object', help='Simulation engine; compact keeps fleet state in typed arrays to reduce memory, coalesced also folds travel tasks into the tasks that schedule them')
+    parser.add_argument('--seed', type=int, default=None, help='Master seed the mining time stream of every truck is derived from (defaults to a random seed)')
+    parser.add_argument('--horizon', type=int, default=None, help='Simulated time in seconds to run up to (defaults to TOTAL_SIM_TIME)')
+    parser.add_argument('--checkpoint', default=None, help='Save a snapshot of the simulation to this path (compact and coalesced engines only)')
+    parser.add_argument('--checkpoint-interval', type=int, default=None, help='Save a snapshot every time this many seconds of simulated time have passed')
+    parser.add_argument('--resume', default=None, help='Resume the simulation from a snapshot, running it up to --horizon')
+    parser.add_argument('--no-fast-path', dest='fast_path', action='store_false', help='Run the event loop even when there are at least as many stations as trucks')
+    parser.add_argument('--top', type=int, default=None, help='Only display this many of the best performing trucks and stations')
+    parser.add_argument('--bottom', type=int, default=None, help='Only display this many of the worst performing trucks and stations')
+    parser.add_argument('--trucks-output', default=None, metavar='PATH', help='Write every truck\'s statistics to this file (.csv, .jsonl or .col)')
+    parser.add_argument('--stations-output', default=None, metavar='PATH', help='Write every station\'s statistics to this file (.csv, .jsonl or .col)')
+    parser.add_argument('--format', choices=sorted(set(OUTPUT_FORMATS.values())), default=None, help='Format of the output files (defaults to the format matching their extension)')
+    parser.add_argument('--distributions', action='store_true', help='Display fleet-wide quantiles of waiting, mining and cycle times and station queue lengths (object engine only)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory of the result cache; runs with a --seed are looked up in it and stored in it')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='Always simulate, without reading or writing the result cache')
+    parser.add_argument('--clear-cache', action='store_true', help='Remove every result from the result cache (-n and -m are then optional)')
+    parser.add_argument('--telemetry', default=None, metavar='PATH', help='Write a time series of the fleet and station state to this file (.csv, .jsonl or .col; object engine only)')
+    parser.add_argument('--telemetry-interval', type=int, default=DEFAULT_INTERVAL, help='Simulated time in seconds between telemetry samples')
+    parser.add_argument('--instrument', default=None, metavar='PATH', help="Write a JSON report of event loop counters and timings to this path ('-' for stdout; object engine only)")
+
+    subparsers = parser.add_subparsers(dest='command')
+    sweep_parser = subparsers.add_parser('sweep', help='Run the simulation over a grid of truck and station counts')
+    sweep_parser.add_argument('-n', '--numTrucks', type=ParseRange, help='Range of mining truck counts (start:stop[:step])', required=True)
+    sweep_parser.add_argument('-m', '--unloadStations', type=ParseRange, help='Range of unload station counts (start:stop[:step])', required=True)
+    sweep_parser.add_argument('-r', '--replications', type=int, default=1, help='Number of replications for each truck and station count')
+    sweep_parser.add_argument('--seed', type=int, default=argparse.SUPPRESS, help='Master seed the seed of every replication is derived from (defaults to 0)')
+    sweep_parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (defaults to the number of CPUs)')
+    sweep_parser.add_argument('--scheduler', choices=sorted(SCHEDULERS), default=argparse.SUPPRESS, help='Task queue implementation used to schedule tasks')
+    sweep_parser.add_argument('--engine', choices=ENGINES, default=argparse.SUPPRESS, help='Simulation engine; compact keeps fleet state in typed arrays to reduce memory, coalesced also folds travel tasks into the tasks that schedule them')
+    sweep_parser.add_argument('--target', type=ParseTarget, action='append', metavar='METRIC=PRECISION', help='Run replications until the confidence interval of a metric is within this fraction of its estimate, e.g. unloads_per_truck=0.01 (may be repeated; replaces -r)')
+    sweep_parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the intervals for --target')
+    sweep_parser.add_argument('--max-replications', type=int, default=1000, help='Most replications for each truck and station count with --target')
+
+    sites_parser = subparsers.add_parser('sites', help='Run several independent mining sites in parallel and merge their statistics')
+    sites_parser.add_argument('-s', '--site', type=ParseSite, action='append', required=True, metavar='TRUCKS:STATIONS', help='Number of mining trucks and unload stations at a site (repeat for every site)')
+    sites_parser.add_argument('--seed', type=int, default=argparse.SUPPRESS, help='Master seed the seed of every site is derived from (defaults to 0)')
+    sites_parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (defaults to the number of CPUs)')
+    sites_parser.add_argument('--scheduler', choices=sorted(SCHEDULERS), default=argparse.SUPPRESS, help='Task queue implementation used to schedule tasks')
+    sites_parser.add_argument('--engine', choices=ENGINES, default=argparse.SUPPRESS, help='Simulation engine; compact keeps fleet state in typed arrays to reduce memory, coalesced also folds travel tasks into the tasks that schedule them')
+    sites_parser.add_argument('--top', type=int, default=argparse.SUPPRESS, help='Only display this many of the best performing trucks and stations')
+    sites_parser.add_argument('--bottom', type=int, default=argparse.SUPPRESS, help='Only display this many of the worst performing trucks and stations')
+
+    # Options shared with the top level default to SUPPRESS in the subcommands, so values given before the subcommand aren't replaced by the subcommand's defaults
+    args = parser.parse_args(argv)
+    if args.command is not None and args.seed is None:
+        # Sweeps and sites derive every run's seed from the master seed, so they are reproducible by default
+        args.seed = 0
+
+    if args.command is None and args.resume is None and not args.clear_cache and (args.numTrucks is None or args.unloadStations is None):
+        parser.error('the following arguments are required: -n/--numTrucks, -m/--unloadStations')
+    # A resumed run is always a compact engine's event loop, which has no hooks for these
+    if args.resume is not None and args.instrument:
+        parser.error('--instrument can\'t be used with --resume')
+    if args.resume is not None and args.distributions:
+        parser.error('--distributions can\'t be used with --resume')
+    if args.resume is not None and args.telemetry:
+        parser.error('--telemetry can\'t be used with --resume')
+    # The sweep and sites commands run many simulations with the default horizon and only report their summaries, so options of a single run don't apply to them
+    if args.command is not None:
+        single_run_options = [('horizon', '--horizon'), ('checkpoint', '--checkpoint'), ('checkpoint_interval', '--checkpoint-interval'), ('resume', '--resume'),
+                              ('fast_path', '--no-fast-path'), ('trucks_output', '--trucks-output'), ('stations_output', '--stations-output'), ('format', '--format'),
+                              ('distributions', '--distributions'), ('telemetry', '--telemetry'), ('telemetry_interval', '--telemetry-interval'),
+                              ('instrument', '--instrument'), ('cache', '--no-cache'), ('cache_dir', '--cache-dir')]
+        if args.command == 'sweep':
+            single_run_options += [('top', '--top'), ('bottom', '--bottom')]
+        for dest, option in single_run_options:
+            if getattr(args, dest) != parser.get_default(dest):
+                parser.error('{} can\'t be used with the {} command'.format(option, args.command))
+    if args.command == 'sweep' and args.replications < 1:
+        parser.error('--replications must be positive')
+    if args.command is not None and args.workers is not None and args.workers < 1:
+        parser.error('--workers must be positive')
+    if args.command == 'sweep' and not 0 < args.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+    if args.command == 'sweep' and args.max_replications < 1:
+        parser.error('--max-replications must be positive')
+    if args.horizon is not None and args.horizon < 0:
+        parser.error('--horizon must not be negative')
+    if args.telemetry_interval <= 0:
+        parser.error('--telemetry-interval must be positive')
+    if args.checkpoint_interval is not None:
+        if args.checkpoint_interval <= 0:
+            parser.error('--checkpoint-interval must be positive')
+        if args.checkpoint is None:
+            parser.error('--checkpoint-interval requires --checkpoint')
     
-    return args.numTrucks, args.unloadStations
+    return args
+
+def SummarizeStatistics(mining_trucks, unload_stations):
+    """ Summarize the statistics of a simulation run into fleet-wide figures.
+
+        Args:
+            mining_trucks (list): List of mining truck instances
+            unload_stations: (list): List of unload station instances
+        Returns:
+            dict: Fleet-wide totals and averages for the run
+    """
 
-def DisplayStatistics(mining_trucks, unload_stations):
+    total_unloads = sum(station.total_unloads for station in unload_stations)
+    total_times_mined = sum(truck.total_times_mined for truck in mining_trucks)
+    time_spent_mining = sum(truck.time_spent_mining for truck in mining_trucks)
+    time_spent_waiting = sum(station.time_spent_waiting for station in unload_stations)
+
+    return {
+        'trucks': len(mining_trucks),
+        'stations': len(unload_stations),
+        'total_unloads': total_unloads,
+        'unloads_per_truck': total_unloads/len(mining_trucks),
+        'unloads_per_station': total_unloads/len(unload_stations),
+        'average_mining_time': time_spent_mining/total_times_mined if total_times_mined else 0,
+        'total_time_waiting': time_spent_waiting,
+        'average_waiting_time': time_spent_waiting/total_unloads if total_unloads else 0,
+    }
+
+def DisplayStatistics(mining_trucks, unload_stations, top=None, bottom=None):
     """ Report statistics/efficiency of the mining trucks and unload stations over the course of the simulation. Mining truck statistics are displayed first, followed by unload station statistics.
+        For large fleets, top and bottom limit the tables to the best and worst performing trucks and stations; these are found by partial selection rather than sorting every entity.
 
         Args:
             mining_trucks (list): List of mining truck instances
             unload_stations: (list): List of unload station instances
+            top (int): Only display this many of the best performing trucks and stations
+            bottom (int): Only display this many of the worst performing trucks and stations (after the top ones, if both are given)
     """
 
     # Sort trucks based off the following criteria: most unloads -> lowest average mining time
-    trucks_sorted = sorted(mining_trucks, key=lambda x: (x.total_unloads, -x.time_spent_mining/x.total_times_mined), reverse=True)
+    trucks_sorted = SelectEntities(mining_trucks, TruckSortKey, top, bottom)
 
     # Sort stations based off the following criteria: most unloads -> lowest total waiting time
-    stations_sorted = sorted(unload_stations, key=lambda x: (x.total_unloads, -x.time_spent_waiting), reverse=True)
+    stations_sorted = SelectEntities(unload_stations, StationSortKey, top, bottom)
 
 
     print("\n---Simulation Complete---\n")
@@ -287,13 +621,7 @@ def DisplayStatistics(mining_trucks, unload_stations):
     print("-"*87)
     
     for truck in trucks_sorted:
-        time_spent_mining = "{}h {}".format(str(truck.time_spent_mining//3600), datetime.datetime.fromtimestamp(truck.time_spent_mining).strftime('%Mm %Ss'))
-        time_spent_waiting = "{}h {}".format(str(truck.time_spent_waiting//3600), datetime.datetime.fromtimestamp(truck.time_spent_waiting).strftime('%Mm %Ss'))
-        
-        average_mining_time_secs = truck.time_spent_mining/truck.total_times_mined
-        average_mining_time = "{}h {}".format(str(int(average_mining_time_secs//3600)), datetime.datetime.fromtimestamp(average_mining_time_secs).strftime('%Mm %Ss'))
-
-        print("{id:>8d} | {tmt:>17s} | {amt:>19s} | {tu:>13d} | {tsw:>18s}".format(id=truck.id, tmt=time_spent_mining, amt=average_mining_time, tu=truck.total_unloads, tsw=time_spent_waiting))
+        print(FormatTruckRow(truck))
     
     #Diplay statistics for each unload station - stations are sorted by total unloads followed by total time trucks spent waiting at that station
     
@@ -302,33 +630,68 @@ def DisplayStatistics(mining_trucks, unload_stations):
     print("-"*83)
     
     for station in stations_sorted:
-        time_spent_waiting = "{}h {}".format(str(station.time_spent_waiting//3600), datetime.datetime.fromtimestamp(station.time_spent_waiting).strftime('%Mm %Ss'))
-        
-        average_waiting_time_secs = 0 if not station.total_unloads else station.time_spent_waiting/station.total_unloads
-        average_truck_waiting_time = "{}h {}".format(str(int(average_waiting_time_secs//3600)), datetime.datetime.fromtimestamp(average_waiting_time_secs).strftime('%Mm %Ss'))
-        
-        print("{id:>10d} | {tup:>13d} | {tttw:>24s} | {atwt:>27s}".format(id=station.id, tup=station.total_unloads, tttw=time_spent_waiting, atwt=average_truck_waiting_time))
+        print(FormatStationRow(station))
 
+def DisplayDistributions(mining_trucks, unload_stations):
+    """ Report the fleet-wide distributions of waiting, mining and cycle times and station queue lengths, merged from the sketches of every truck and station.
 
-def RunSimulation(n, m):
-    """ Runs the simulation of a lunar Helium-3 mining operation. The simulation represents 72 hours of non-stop mining and must execute faster than real-time to provide timely analysis.
-        Provides statistics related to truck/unload station performance and efficiency upon simulation completion.
+        Args:
+            mining_trucks (list): List of mining truck instances created with distributions enabled
+            unload_stations: (list): List of unload station instances created with distributions enabled
+    """
+
+    fleet = FleetDistributions(mining_trucks, unload_stations)
+    rows = (('Truck wait time', 'truck_wait_times', FormatDuration), ('Mining time', 'truck_mining_times', FormatDuration), ('Cycle time', 'truck_cycle_times', FormatDuration),
+            ('Station queue length', 'station_queue_lengths', '{:.1f}'.format))
+
+    print("\nFleet Distributions")
+    print("\n{:<20s} | {:>7s} | {:>11s} | {:>11s} | {:>11s} | {:>11s} | {:>11s} | {:>11s}".format('Statistic', 'Count', 'Mean', 'Std Dev', 'P50', 'P95', 'P99', 'Max'))
+    print("-"*114)
+
+    for label, name, format_value in rows:
+        summary = fleet[name].summary()
+        if not summary['count']:
+            continue
+        print("{:<20s} | {:>7d} | {:>11s} | {:>11s} | {:>11s} | {:>11s} | {:>11s} | {:>11s}".format(label, summary['count'],
+            *(format_value(summary[key]) for key in ('mean', 'stddev', 'p50', 'p95', 'p99', 'max'))))
+
+
+def RunObjectSimulation(n, m, scheduler='heap', horizon=None, instrumentation=None, distributions=False, seed=None, distribution=None, telemetry=None):
+    """ Run the simulation with a MiningTruck and UnloadStation instance for every truck and station, and tasks scheduled as bound methods of those instances.
 
         Args:
             n (int): Number of mining trucks in the simulation.
             m (int): Number of unload stations in the simulation.
+            scheduler (str): Name of the task queue implementation to use (see SCHEDULERS).
+            horizon (int): Time (in seconds) to run the simulation up to; defaults to TOTAL_SIM_TIME.
+            instrumentation (Instrumentation): Collects counters from the event loop. When None the loop isn't instrumented at all.
+            distributions (bool): Keep quantile sketches of waiting, mining, cycle times and queue lengths in every truck and station (see distributions.py).
+            seed (int): Master seed of the trucks' mining time streams (see MiningStreams); defaults to one drawn from the random module.
+            distribution (instance): Distribution of mining times (see streams.py); defaults to uniform between 1 and 5 hours.
+            telemetry (Telemetry): Samples the state of the fleet and stations as the event loop runs. When None the loop doesn't sample anything.
+        Returns:
+            tuple (list, list): The MiningTruck and UnloadStation instances used in the simulation
     """
 
-    # Verify that both the number of trucks and number of stations is greather than zero
-    if n < 1 or m < 1:
-        print("The number of mining trucks and unload stations must be greater than zero")
-        sys.exit()
-
+    if horizon is None:
+        horizon = const.TOTAL_SIM_TIME
 
     # Initialize instances of each mining truck/unload station and the task_queue
-    task_queue = TaskQueue()
-    mining_trucks = [MiningTruck(i+1, task_queue) for i in range(n)] # instantiating a MiningTruck adds a mining task to the task queue
-    unload_stations = [UnloadStation(i+1) for i in range(m)]
+    unload_stations = [UnloadStation(i+1, distributions) for i in range(m)]
+    task_queue = SCHEDULERS[scheduler]()
+    if telemetry is not None:
+        telemetry.start(n, unload_stations, horizon)
+        task_queue = TelemetryTaskQueue(task_queue, telemetry)
+    if instrumentation is not None:
+        task_queue = InstrumentedTaskQueue(task_queue, instrumentation)
+    streams = MiningStreams(n, seed, distribution)
+    if instrumentation is not None:
+        # The trucks' initial tasks go through the instrumented task queue, so the wall time starts before they are scheduled
+        instrumentation.start()
+    mining_trucks = [MiningTruck(i+1, task_queue, distributions, streams) for i in range(n)] # instantiating a MiningTruck adds a mining task to the task queue
+    station_index = UnloadStationIndex(unload_stations)
+    if instrumentation is not None:
+        station_index = InstrumentedStationIndex(station_index, instrumentation)
     
 
     # A task is an action that can be performed by a mining truck (mine, unload, travel to station/mine). Each task is represented by a function within the MiningTruck class. These tasks are inserted into a task queue in the form of tuples (task, task time - time task should be performed). The loop below continuously pulls the next task that should be performed and runs the task (function). Each function then returns the next task (tuple) that should be performed by that truck, which is then added back into the queue. The loop breaks when the 72 hour mark has been passed.
@@ -336,30 +699,187 @@ def RunSimulation(n, m):
     while True:
         task, time = task_queue.getCurrentTask()
 
-        # Verify the simulation time hasn't passed the 72 hour mark; if it does, break
-        if time > const.TOTAL_SIM_TIME:
+        # Verify the simulation time hasn't passed the 72 hour mark (or the given horizon); if it does, break
+        if time > horizon:
             break
 
         if task.__name__ == 'unload':
-            station = GetNextUnloadStation(unload_stations, time)
+            station = station_index.getNextUnloadStation(time)
             nextTask = task(time, station)
-            task_queue.enqueue((station.startNextUnload, time+station.queueTime(time)))
+            station_index.update(station)
+            task_queue.enqueue((station.startNextUnload, time+station.queueTime(time)), TASK_PRIORITY_UNLOAD_COMPLETE)
         else:
             nextTask = task(time)
 
         # Add the truck's next task to the task queue
         if nextTask:
             task_queue.enqueue(nextTask)
-    
+
+    if instrumentation is not None:
+        instrumentation.stop()
+
+    return mining_trucks, unload_stations
+
+def RunSimulation(n, m, scheduler='heap', display=True, engine='object', horizon=None, checkpoint_interval=None, checkpoint_path=None, instrumentation=None, fast_path=True, distributions=False, seed=None, distribution=None, cache=None, telemetry=None):
+    """ Runs the simulation of a lunar Helium-3 mining operation. The simulation represents 72 hours of non-stop mining and must execute faster than real-time to provide timely analysis.
+        Provides statistics related to truck/unload station performance and efficiency upon simulation completion.
+
+        Args:
+            n (int): Number of mining trucks in the simulation.
+            m (int): Number of unload stations in the simulation.
+            scheduler (str): Name of the task queue implementation to use (see SCHEDULERS). Both implementations produce identical results.
+            display (bool): Display statistics when the simulation is complete.
+            engine (str): 'object' to model each truck and station as an instance, 'compact' to keep fleet state in typed arrays, or 'coalesced' to also fold the travel and unload completion tasks into the tasks that schedule them (see compact_simulation.py). All engines produce identical results.
+            horizon (int): Time (in seconds) to run the simulation up to; defaults to TOTAL_SIM_TIME.
+            checkpoint_interval (int): Save a snapshot every time this many seconds of simulated time have passed (compact and coalesced engines only).
+            checkpoint_path (str): Path the snapshots are saved to. A snapshot is also saved once the horizon is reached, so the simulation can be extended with ResumeSimulation.
+            instrumentation (Instrumentation): Collects counters and timings from the event loop (object engine only). See instrumentation.py.
+            fast_path (bool): Skip the event loop for contention-free configurations (at least as many stations as trucks, see fast_path.py) unless checkpoints, instrumentation, distributions or telemetry are requested.
+                The fast path's statistics follow the same distribution as the engines but aren't identical to them for the same seed.
+            distributions (bool): Keep quantile sketches of waiting, mining, cycle times and queue lengths in every truck and station (object engine only). See distributions.py.
+            seed (int): Master seed of the trucks' mining time streams (see streams.py). Each truck draws from its own stream, so the same seed produces the same results with every engine.
+                Defaults to a seed drawn from the random module, so runs are also reproducible with random.seed.
+            distribution (instance): Distribution of mining times, e.g. streams.HistogramDuration; defaults to uniform between 1 and 5 hours.
+            cache (ResultCache): Return the stored statistics of runs with the same configuration and seed instead of simulating them, and store the statistics of new runs (see result_cache.py).
+                Only runs with a seed and the default distribution, and without checkpoints, instrumentation, distributions or telemetry, are cached.
+            telemetry (Telemetry): Samples counts of trucks mining, travelling and queued, unloads and station queue depths at a fixed interval of simulated time (object engine only). See telemetry.py.
+        Returns:
+            tuple (list, list): The mining trucks and unload stations used in the simulation. Cached results are views with the same statistics attributes as MiningTruck and UnloadStation. With the compact engine these are views with the same statistics attributes as MiningTruck and UnloadStation.
+    """
+
+    # Verify that both the number of trucks and number of stations is greather than zero
+    if n < 1 or m < 1:
+        print("The number of mining trucks and unload stations must be greater than zero")
+        sys.exit()
+
+    if horizon is not None and horizon < 0:
+        print("The horizon must not be negative")
+        sys.exit()
+
+    # The compact engines' event loops are kept free of hooks; instrumentation wraps the object engine's task queue and station index
+    if instrumentation is not None and engine != 'object':
+        print("Instrumentation is only supported by the object engine")
+        sys.exit()
+
+    # The compact engines keep fixed-width counters per truck in typed arrays, which have no room for sketches
+    if distributions and engine != 'object':
+        print("Distributions are only supported by the object engine")
+        sys.exit()
+
+    # Telemetry samples the stations' queues, which only the object engine keeps
+    if telemetry is not None and engine != 'object':
+        print("Telemetry is only supported by the object engine")
+        sys.exit()
+
+    # Checkpoints, instrumentation, distributions and telemetry all need the event loop to run
+    observed = bool(checkpoint_path) or instrumentation is not None or distributions or telemetry is not None
+    use_fast_path = fast_path and IsContentionFree(n, m, distribution) and not observed
+
+    # Runs that are fully determined by their configuration can be looked up in the cache
+    cacheable = cache is not None and seed is not None and distribution is None and not observed
+    cached = None
+    if cacheable:
+        cache_key = CacheKey(n, m, seed, horizon, use_fast_path)
+        cached = cache.get(cache_key)
+
+    if cached is not None:
+        mining_trucks, unload_stations = cached
+    elif use_fast_path:
+        # No truck can ever wait, so each truck's trajectory is computed independently of the others
+        mining_trucks, unload_stations = RunContentionFreeSimulation(n, m, horizon, seed, distribution)
+    elif engine in ('compact', 'coalesced'):
+        mining_trucks, unload_stations = RunCompactSimulation(n, m, coalesce=engine == 'coalesced', horizon=horizon, checkpoint_interval=checkpoint_interval, checkpoint_path=checkpoint_path, seed=seed, distribution=distribution)
+    else:
+        # Snapshots need tasks that can be saved to disk, which the object engine's bound methods can't be
+        if checkpoint_path:
+            print("Checkpoints are only supported by the compact and coalesced engines")
+            sys.exit()
+        mining_trucks, unload_stations = RunObjectSimulation(n, m, scheduler, horizon, instrumentation, distributions, seed, distribution, telemetry)
+
+    if cacheable and cached is None:
+        cache.put(cache_key, mining_trucks, unload_stations)
 
     # Display statistics of the performance/efficiency of each mining truck and unload station
-    DisplayStatistics(mining_trucks, unload_stations)
+    if display:
+        DisplayStatistics(mining_trucks, unload_stations)
+
+    return mining_trucks, unload_stations
+
+def ResumeSimulation(path, horizon=None, display=True, checkpoint_interval=None, checkpoint_path=None):
+    """ Resume a simulation from a snapshot saved by the compact or coalesced engine and run it up to a later horizon. The results are identical to an uninterrupted run to the same horizon.
+
+        Args:
+            path (str): Path of the snapshot to resume from.
+            horizon (int): Time (in seconds) to run the simulation up to; defaults to TOTAL_SIM_TIME. If the snapshot is already past the horizon, its statistics are returned as is.
+            display (bool): Display statistics when the simulation is complete.
+            checkpoint_interval (int): Save a snapshot every time this many seconds of simulated time have passed.
+            checkpoint_path (str): Path the snapshots are saved to.
+        Returns:
+            tuple (list, list): Views of the mining trucks and unload stations, see RunSimulation
+    """
+
+    simulation = CompactSimulation.load(path)
+    simulation.run(const.TOTAL_SIM_TIME if horizon is None else horizon, checkpoint_interval, checkpoint_path)
+    mining_trucks, unload_stations = simulation.results()
+
+    if display:
+        DisplayStatistics(mining_trucks, unload_stations)
+
+    return mining_trucks, unload_stations
        
 
 
 if __name__ == '__main__':
-    # Get number of mining trucks (n) and number of unload stations (m)
-    n, m = ParseArgs() 
-    
-    # Run the simulation with the desired number of trucks and stations
-    RunSimulation(n, m)
+    # Get number of mining trucks (n), number of unload stations (m) and simulation options
+    args = ParseArgs()
+
+    if args.clear_cache:
+        print("Removed {} cached results from {}".format(ResultCache(args.cache_dir).clear(), args.cache_dir))
+        # Clearing the cache doesn't need a simulation to run afterwards
+        if args.command is None and args.resume is None and (args.numTrucks is None or args.unloadStations is None):
+            sys.exit()
+
+    if args.command == 'sweep':
+        import sweep
+
+        # Run the simulation for every combination of trucks and stations across a pool of worker processes
+        if args.target:
+            # Run batches of replications until every target metric's confidence interval is precise enough
+            targets = dict(args.target)
+            results = sweep.RunAdaptiveSweep(args.numTrucks, args.unloadStations, targets=targets, confidence=args.confidence, max_replications=args.max_replications,
+                                             seed=args.seed, workers=args.workers, scheduler=args.scheduler, engine=args.engine)
+            sweep.DisplayAdaptiveSweep(results, targets, args.confidence)
+        else:
+            results = sweep.RunSweep(args.numTrucks, args.unloadStations, replications=args.replications, seed=args.seed, workers=args.workers, scheduler=args.scheduler, engine=args.engine)
+            sweep.DisplaySweep(results)
+    elif args.command == 'sites':
+        import sites
+
+        # Run every site in its own worker process and merge their trucks and stations into one report
+        mining_trucks, unload_stations, summaries = sites.RunSites(args.site, seed=args.seed, workers=args.workers, scheduler=args.scheduler, engine=args.engine)
+        DisplayStatistics(mining_trucks, unload_stations, top=args.top, bottom=args.bottom)
+        sites.DisplaySites(summaries)
+    else:
+        instrumentation = Instrumentation() if args.instrument else None
+        telemetry = Telemetry(args.telemetry_interval) if args.telemetry else None
+
+        if args.resume:
+            # Continue a simulation from a snapshot, up to the desired horizon
+            mining_trucks, unload_stations = ResumeSimulation(args.resume, horizon=args.horizon, display=False, checkpoint_interval=args.checkpoint_interval, checkpoint_path=args.checkpoint)
+        else:
+            # Run the simulation with the desired number of trucks and stations
+            mining_trucks, unload_stations = RunSimulation(args.numTrucks, args.unloadStations, scheduler=args.scheduler, display=False, engine=args.engine, horizon=args.horizon, checkpoint_interval=args.checkpoint_interval, checkpoint_path=args.checkpoint, instrumentation=instrumentation, fast_path=args.fast_path, distributions=args.distributions, seed=args.seed, cache=ResultCache(args.cache_dir) if args.cache else None, telemetry=telemetry)
+
+        DisplayStatistics(mining_trucks, unload_stations, top=args.top, bottom=args.bottom)
+        if args.distributions:
+            DisplayDistributions(mining_trucks, unload_stations)
+
+        # Stream the full per-truck and per-station statistics to files
+        if args.trucks_output:
+            WriteEntities(args.trucks_output, mining_trucks, TRUCK_FIELDS, args.format)
+        if args.stations_output:
+            WriteEntities(args.stations_output, unload_stations, STATION_FIELDS, args.format)
+        if instrumentation is not None:
+            instrumentation.write(args.instrument)
+        if telemetry is not None:
+            telemetry.write(args.telemetry, args.format)
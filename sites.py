@@ -0,0 +1,106 @@
+import concurrent.futures
+import os
+from simulation import RunSimulation, SummarizeStatistics
+from compact_simulation import FleetStore, StoreEntities
+from sweep import DeriveSeed
+from report import FormatDuration
+
+
+def RunSite(site, n, m, seed=0, scheduler='heap', engine='object'):
+    """ Run the simulation of a single site with a seed derived from the master seed. This is the unit of work sent to each worker process by RunSites.
+
+        Args:
+            site (int): Index of the site in the layout
+            n (int): Number of mining trucks at the site
+            m (int): Number of unload stations at the site
+            seed (int): Master seed the seed of the site is derived from
+            scheduler (str): Name of the task queue implementation to use
+            engine (str): Simulation engine to use (see RunSimulation)
+        Returns:
+            FleetStore: The statistics of the site's trucks and stations
+    """
+
+    mining_trucks, unload_stations = RunSimulation(n, m, scheduler=scheduler, display=False, engine=engine, seed=DeriveSeed(seed, 'site', site))
+    return StoreEntities(mining_trucks, unload_stations)
+
+def _RunSite(args):
+    """ Unpack a site and run it; used with ProcessPoolExecutor.submit """
+    return RunSite(*args)
+
+def MergeSites(stores):
+    """ Merge the statistics of every site into one FleetStore, with the trucks and stations of each site following those of the previous site.
+
+        Args:
+            stores (list): FleetStores returned by RunSite, in site order
+        Returns:
+            FleetStore: The statistics of every truck and station
+    """
+
+    merged = FleetStore(0, 0)
+    for store in stores:
+        for name in FleetStore.__slots__:
+            getattr(merged, name).extend(getattr(store, name))
+    return merged
+
+def RunSites(layout, seed=0, workers=None, scheduler='heap', engine='object'):
+    """ Run a simulation of several independent mining sites, each with its own trucks and unload stations, running each site's event loop in a separate worker process.
+        No truck moves between sites, so the sites are simulated independently and their statistics merged. Sites are handed to the workers largest (most trucks) first,
+        so with enough workers the wall time is that of the largest site. Every site is seeded with DeriveSeed(seed, 'site', index), so results don't depend on the number of workers.
+
+        Args:
+            layout (list): (trucks, stations) of every site
+            seed (int): Master seed the seed of every site is derived from
+            workers (int): Number of worker processes; defaults to the number of CPUs (and at most the number of sites). With a single worker the sites are run in this process.
+            scheduler (str): Name of the task queue implementation to use
+            engine (str): Simulation engine to use (see RunSimulation)
+        Returns:
+            tuple (list, list, list): Views of every truck and station across all sites, numbered consecutively site after site, and a summary of every site
+                                      (see SummarizeStatistics) along with its index
+    """
+
+    layout = list(layout)
+    if not layout or min(min(site) for site in layout) < 1:
+        raise ValueError("Every site needs at least one mining truck and one unload station")
+
+    sites = [(index, n, m, seed, scheduler, engine) for index, (n, m) in enumerate(layout)]
+    workers = min(workers or os.cpu_count() or 1, len(sites))
+
+    if workers == 1:
+        stores = [_RunSite(site) for site in sites]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {site[0]: executor.submit(_RunSite, site) for site in sorted(sites, key=lambda site: site[1], reverse=True)}
+            stores = [futures[index].result() for index in range(len(sites))]
+
+    summaries = []
+    for index, store in enumerate(stores):
+        summary = SummarizeStatistics(store.trucks(), store.stations())
+        summary['site'] = index
+        summaries.append(summary)
+
+    merged = MergeSites(stores)
+    return merged.trucks(), merged.stations(), summaries
+
+def DisplaySites(summaries):
+    """ Display a table with one row per site, followed by the whole operation.
+
+        Args:
+            summaries (list): Site summaries returned by RunSites
+    """
+
+    print("\n---Sites---\n")
+    print("Site | Trucks | Stations | Total Unloads | Unloads Per Truck | Unloads Per Station | Avg Waiting Time Per Unload")
+    print("-"*112)
+
+    row = "{site:>4s} | {n:>6d} | {m:>8d} | {tu:>13d} | {upt:>17.2f} | {ups:>19.2f} | {awt:>27s}"
+    for summary in summaries:
+        print(row.format(site=str(summary['site'] + 1), n=summary['trucks'], m=summary['stations'], tu=summary['total_unloads'], upt=summary['unloads_per_truck'],
+                         ups=summary['unloads_per_station'], awt=FormatDuration(summary['average_waiting_time'])))
+
+    trucks = sum(summary['trucks'] for summary in summaries)
+    stations = sum(summary['stations'] for summary in summaries)
+    total_unloads = sum(summary['total_unloads'] for summary in summaries)
+    total_time_waiting = sum(summary['total_time_waiting'] for summary in summaries)
+    print("-"*112)
+    print(row.format(site='All', n=trucks, m=stations, tu=total_unloads, upt=total_unloads/trucks, ups=total_unloads/stations,
+                     awt=FormatDuration(total_time_waiting/total_unloads if total_unloads else 0)))
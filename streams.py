@@ -0,0 +1,171 @@
+import array
+import random
+import numpy as np
+import constants as const
+
+# Mining durations are uniformly distributed between 1 and 5 hours (in seconds) by default
+MIN_MINING_TIME = 3600
+MAX_MINING_TIME = 18000
+
+# Constants of the SplitMix64 generator
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+MASK_64 = (1 << 64) - 1
+
+# Number of durations buffered for each truck. Blocks are refilled for TRUCKS_PER_REFILL neighbouring trucks at once, which amortizes NumPy's per-call overhead
+# while keeping the buffer at 4*BLOCK_SIZE bytes per truck whatever the horizon.
+BLOCK_SIZE = 8
+TRUCKS_PER_REFILL = 64
+
+# Durations are generated for this many trucks at a time when filling the first blocks or sampling, to bound the memory of NumPy's temporary arrays
+TRUCKS_PER_CHUNK = 1024
+
+
+def _Mix(x):
+    """ SplitMix64's output function, applied to an array of unsigned 64 bit integers """
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB
+    return x ^ (x >> 31)
+
+def MaxDraws(horizon, distribution):
+    """ Return the most mining durations a truck can draw before the horizon: its k-th mining operation starts no earlier than k times the shortest cycle
+        (the shortest duration plus the trips to and from the unload station).
+    """
+    return horizon//(distribution.minimum + 2*const.TRAVEL_TIME) + 1
+
+
+class UniformDuration():
+    """ Mining durations uniformly distributed over the integers from low to high (inclusive) """
+
+    def __init__(self, low=MIN_MINING_TIME, high=MAX_MINING_TIME):
+        self.low = low
+        self.high = high
+
+    @property
+    def minimum(self):
+        """ The shortest possible duration """
+        return self.low
+
+    def sample(self, uniforms):
+        """ Map uniform random numbers in [0, 1) to durations.
+
+            Args:
+                uniforms (ndarray): Uniform random numbers
+            Returns:
+                ndarray: A duration (int64) for each number
+        """
+        return self.low + np.floor(uniforms*(self.high - self.low + 1)).astype(np.int64)
+
+
+class HistogramDuration():
+    """ Mining durations following an empirical histogram: a bin is chosen with probability proportional to its count, then a duration uniformly within the bin """
+
+    def __init__(self, edges, counts):
+        """ Initialize a HistogramDuration.
+
+            Args:
+                edges (list): Increasing bin edges in seconds; bin i covers the integers from edges[i] up to (but excluding) edges[i+1]
+                counts (list): Number of observations in each bin (one fewer than the edges)
+        """
+
+        if len(edges) != len(counts) + 1:
+            raise ValueError("A histogram needs one more edge than bin counts")
+        self.edges = np.asarray(edges, dtype=np.int64)
+        self.cumulative = np.cumsum(counts, dtype=np.float64)/sum(counts)
+
+    @property
+    def minimum(self):
+        """ The shortest possible duration """
+        return int(self.edges[0])
+
+    def sample(self, uniforms):
+        """ Map uniform random numbers in [0, 1) to durations, see UniformDuration.sample """
+
+        bins = np.minimum(np.searchsorted(self.cumulative, uniforms, side='right'), len(self.cumulative) - 1)
+        lower = np.where(bins > 0, self.cumulative[bins - 1], 0.0)
+        # The position of a number within its bin's share of [0, 1) is itself uniform, so it also picks the duration within the bin
+        within = (uniforms - lower)/(self.cumulative[bins] - lower)
+        widths = self.edges[bins + 1] - self.edges[bins]
+        return self.edges[bins] + np.minimum(np.floor(within*widths).astype(np.int64), widths - 1)
+
+
+class MiningStreams():
+    """ An independent stream of mining durations for every truck, derived from a master seed with the splittable SplitMix64 generator.
+        The k-th duration of truck t is a function of the seed, t and k only, so it doesn't depend on the order events are performed in, the engine, the number of worker
+        processes or whether the simulation was resumed from a snapshot. Each truck buffers a block of its upcoming durations, so drawing one is usually a buffer read.
+        When a truck's block runs out, the blocks of the TRUCKS_PER_REFILL trucks around it are regenerated together, each starting from that truck's next draw.
+
+        Attributes:
+            seed (int): The 64 bit master seed
+            distribution (instance): Maps uniform random numbers to durations (see UniformDuration)
+            block_size (int): Number of durations buffered for each truck
+            buffer (array): The current block of durations of every truck, truck after truck
+            draws (array): Number of durations drawn by each truck
+            ends (array): Index of the draw following the last one in each truck's block
+    """
+
+    __slots__ = ('seed', 'distribution', 'block_size', 'buffer', 'draws', 'ends')
+
+    def __init__(self, n, seed=None, distribution=None, block_size=BLOCK_SIZE):
+        """ Initialize the streams of n trucks and generate their first block of durations.
+
+            Args:
+                n (int): Number of trucks
+                seed (int): Master seed; defaults to 64 bits from the random module, so runs stay reproducible with random.seed
+                distribution (instance): Distribution of the durations; defaults to UniformDuration()
+                block_size (int): Number of durations buffered for each truck
+        """
+
+        self.seed = (random.getrandbits(64) if seed is None else seed) & MASK_64
+        self.distribution = UniformDuration() if distribution is None else distribution
+        self.block_size = block_size
+        self.draws = array.array('i', bytes(4*n))
+        self.ends = array.array('i', [block_size])*n
+        self.buffer = array.array('i')
+        for first in range(0, n, TRUCKS_PER_CHUNK):
+            self.buffer.frombytes(self.sample(first, min(first + TRUCKS_PER_CHUNK, n), block_size).astype(np.int32).tobytes())
+
+    def _uniforms(self, trucks, draws):
+        """ Uniform random numbers in [0, 1) for every combination of truck index (column vector) and draw index (row vector) """
+
+        seed = np.uint64(self.seed)
+        keys = _Mix(seed + (trucks.astype(np.uint64) + np.uint64(1))*np.uint64(GOLDEN_GAMMA))
+        words = _Mix(keys + (draws.astype(np.uint64) + np.uint64(1))*np.uint64(GOLDEN_GAMMA))
+        return (words >> np.uint64(11))*2.0**-53
+
+    def sample(self, start, stop, count):
+        """ Generate the first durations of a range of trucks at once.
+
+            Args:
+                start (int): Index of the first truck
+                stop (int): Index after the last truck
+                count (int): Number of durations for each truck
+            Returns:
+                ndarray: A (stop - start, count) array of durations; each row holds the durations a truck draws, in order
+        """
+        return self.distribution.sample(self._uniforms(np.arange(start, stop)[:, None], np.arange(count)[None, :]))
+
+    def _refill(self, truck):
+        """ Regenerate the blocks of the TRUCKS_PER_REFILL trucks around a truck whose block ran out, each starting from the truck's next draw """
+
+        block_size = self.block_size
+        first = truck - truck % TRUCKS_PER_REFILL
+        stop = min(first + TRUCKS_PER_REFILL, len(self.draws))
+        starts = np.array(self.draws[first:stop], dtype=np.int64)
+        durations = self.distribution.sample(self._uniforms(np.arange(first, stop)[:, None], starts[:, None] + np.arange(block_size)[None, :]))
+        self.buffer[first*block_size:stop*block_size] = array.array('i', durations.astype(np.int32).tobytes())
+        self.ends[first:stop] = array.array('i', (starts + block_size).astype(np.int32).tobytes())
+
+    def draw(self, truck):
+        """ Draw the next mining duration of a truck.
+
+            Args:
+                truck (int): Index of the truck (its id minus one)
+            Returns:
+                int: The duration in seconds
+        """
+
+        k = self.draws[truck]
+        if k >= self.ends[truck]:
+            self._refill(truck)
+        self.draws[truck] = k + 1
+        return self.buffer[(truck + 1)*self.block_size + k - self.ends[truck]]
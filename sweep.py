@@ -0,0 +1,323 @@
+import concurrent.futures
+import hashlib
+import math
+import os
+import statistics
+from simulation import RunSimulation, SummarizeStatistics
+from report import FormatDuration
+
+# Fleet-wide figures from SummarizeStatistics that are averaged across the replications of a sweep point
+SWEEP_METRICS = ('total_unloads', 'unloads_per_truck', 'unloads_per_station', 'average_mining_time', 'total_time_waiting', 'average_waiting_time')
+
+# Adaptive sweeps stop a sweep point once the confidence interval of each target metric is within this fraction of its estimate (relative half-width), by default
+DEFAULT_TARGETS = {'unloads_per_truck': 0.01}
+DEFAULT_CONFIDENCE = 0.95
+# Replications are run in batches of this size for every sweep point that hasn't converged. The size doesn't depend on the number of workers, so neither do the results.
+DEFAULT_BATCH_SIZE = 8
+# Fewest replications a sweep point can stop at, so early variance estimates aren't trusted, and most replications it can use
+MIN_REPLICATIONS = 5
+DEFAULT_MAX_REPLICATIONS = 1000
+
+# TQuantile bisects until the quantile is known to this relative precision. The continued fraction of the incomplete beta function stops once a term changes it by less
+# than BETA_TOLERANCE, which takes a few dozen terms at most for the degrees of freedom used here.
+QUANTILE_TOLERANCE = 1e-10
+BETA_TOLERANCE = 1e-14
+BETA_MAX_ITERATIONS = 300
+
+
+def DeriveSeed(seed, *keys):
+    """ Derive a seed for one simulation run from a master seed. The same master seed and keys always produce the same seed, regardless of which process computes it.
+
+        Args:
+            seed (int): The master seed
+            keys (int): Values identifying the run, e.g. the number of trucks, number of stations and replication index
+        Returns:
+            int: A 64 bit seed for the run
+    """
+
+    digest = hashlib.sha256(':'.join(str(key) for key in (seed,) + keys).encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def RunReplication(n, m, replication, seed=0, scheduler='heap', engine='object'):
+    """ Run a single replication of the simulation with a seed derived from the master seed, and summarize its statistics.
+        This is the unit of work sent to each worker process by RunSweep.
+
+        Args:
+            n (int): Number of mining trucks in the simulation.
+            m (int): Number of unload stations in the simulation.
+            replication (int): Index of the replication for this truck and station count.
+            seed (int): Master seed the seed of the replication is derived from.
+            scheduler (str): Name of the task queue implementation to use.
+            engine (str): Simulation engine to use (see RunSimulation).
+        Returns:
+            dict: Fleet-wide statistics of the run (see SummarizeStatistics), along with the replication index and its seed
+    """
+
+    run_seed = DeriveSeed(seed, n, m, replication)
+    mining_trucks, unload_stations = RunSimulation(n, m, scheduler=scheduler, display=False, engine=engine, seed=run_seed)
+
+    summary = SummarizeStatistics(mining_trucks, unload_stations)
+    summary['replication'] = replication
+    summary['seed'] = run_seed
+    return summary
+
+def _RunReplication(point):
+    """ Unpack a sweep point and run it; used with ProcessPoolExecutor.map """
+    return RunReplication(*point)
+
+def MergeReplications(runs):
+    """ Merge the summaries of every replication of a single truck and station count into one row. Replications are merged in order of their index so the result doesn't depend on the order they completed in.
+
+        Args:
+            runs (list): Summaries returned by RunReplication for the same truck and station count
+        Returns:
+            dict: The truck and station count, number of replications, and the mean of each metric in SWEEP_METRICS across the replications
+    """
+
+    runs = sorted(runs, key=lambda run: run['replication'])
+    row = {'trucks': runs[0]['trucks'], 'stations': runs[0]['stations'], 'replications': len(runs)}
+    for metric in SWEEP_METRICS:
+        row[metric] = sum(run[metric] for run in runs)/len(runs)
+    return row
+
+def RunSweep(trucks, stations, replications=1, seed=0, workers=None, scheduler='heap', engine='object'):
+    """ Run the simulation for every combination of truck and station counts, spreading the runs across a pool of worker processes.
+        Every run is seeded with DeriveSeed(seed, n, m, replication), so results are identical no matter how many workers are used.
+
+        Args:
+            trucks (iterable): Numbers of mining trucks to simulate
+            stations (iterable): Numbers of unload stations to simulate
+            replications (int): Number of replications for each truck and station count
+            seed (int): Master seed the seed of every replication is derived from
+            workers (int): Number of worker processes; defaults to the number of CPUs. With a single worker the runs are performed in this process.
+            scheduler (str): Name of the task queue implementation to use
+            engine (str): Simulation engine to use (see RunSimulation)
+        Returns:
+            list: One row per truck and station count (see MergeReplications), ordered by trucks then stations
+    """
+
+    trucks, stations = list(trucks), list(stations)
+    if not trucks or not stations or min(trucks) < 1 or min(stations) < 1:
+        raise ValueError("The number of mining trucks and unload stations must be greater than zero")
+    if replications < 1:
+        raise ValueError("The number of replications must be greater than zero")
+
+    points = [(n, m, replication, seed, scheduler, engine) for n in trucks for m in stations for replication in range(replications)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        runs = [_RunReplication(point) for point in points]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            runs = list(executor.map(_RunReplication, points, chunksize=max(1, len(points)//(workers*4))))
+
+    # Group the replications of each truck and station count
+    grouped = {}
+    for run in runs:
+        grouped.setdefault((run['trucks'], run['stations']), []).append(run)
+
+    return [MergeReplications(grouped[key]) for key in sorted(grouped)]
+
+def _BetaContinuedFraction(x, a, b):
+    """ Evaluate the continued fraction of the regularized incomplete beta function with the modified Lentz method (see Numerical Recipes, betacf) """
+
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b)*x/(a + 1)
+    d = 1/(d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, BETA_MAX_ITERATIONS + 1):
+        for numerator in (m*(b - m)*x/((a + 2*m - 1)*(a + 2*m)), -(a + m)*(a + b + m)*x/((a + 2*m)*(a + 2*m + 1))):
+            d = 1 + numerator*d
+            d = 1/(d if abs(d) > tiny else tiny)
+            c = 1 + numerator/c
+            c = c if abs(c) > tiny else tiny
+            h *= d*c
+        if abs(d*c - 1) < BETA_TOLERANCE:
+            break
+    return h
+
+def _RegularizedBeta(x, a, b):
+    """ The regularized incomplete beta function I_x(a, b) """
+
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a*math.log(x) + b*math.log(1 - x))
+    # The continued fraction converges quickly below this point; above it, use the symmetry I_x(a, b) = 1 - I_(1-x)(b, a)
+    if x < (a + 1)/(a + b + 2):
+        return front*_BetaContinuedFraction(x, a, b)/a
+    return 1 - front*_BetaContinuedFraction(1 - x, b, a)/b
+
+def TCdf(t, dof):
+    """ The cumulative distribution function of Student's t-distribution.
+
+        Args:
+            t (float): The value
+            dof (int): Degrees of freedom
+        Returns:
+            float: The probability of a value at most t
+    """
+
+    tail = _RegularizedBeta(dof/(dof + t*t), dof/2, 0.5)/2
+    return 1 - tail if t > 0 else tail
+
+def TQuantile(p, dof):
+    """ Compute a quantile of Student's t-distribution by bisection on TCdf, exact to within QUANTILE_TOLERANCE for any probability and number of degrees of freedom.
+
+        Args:
+            p (float): The probability, strictly between 0 and 1, e.g. 0.975 for a two-sided 95% interval
+            dof (int): Degrees of freedom
+        Returns:
+            float: The quantile
+    """
+
+    if not 0 < p < 1:
+        raise ValueError("The probability must be between 0 and 1")
+    if p < 0.5:
+        return -TQuantile(1 - p, dof)
+
+    low, high = 0.0, 1.0
+    while TCdf(high, dof) < p:
+        low, high = high, 2*high
+    while high - low > QUANTILE_TOLERANCE*high:
+        middle = (low + high)/2
+        if TCdf(middle, dof) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high)/2
+
+def ConfidenceInterval(values, confidence=DEFAULT_CONFIDENCE):
+    """ Compute the mean of a sample and the half-width of its confidence interval.
+
+        Args:
+            values (list): Values of a metric, one per replication
+            confidence (float): Confidence level of the interval
+        Returns:
+            tuple (float, float): The mean and the half-width of the interval (infinite with fewer than two values)
+    """
+
+    mean = sum(values)/len(values)
+    if len(values) < 2:
+        return mean, math.inf
+    return mean, TQuantile((1 + confidence)/2, len(values) - 1)*statistics.stdev(values)/math.sqrt(len(values))
+
+def Converged(runs, targets, confidence=DEFAULT_CONFIDENCE):
+    """ Check whether the confidence interval of every target metric is within its relative precision. A metric that is zero in every replication has converged. """
+
+    if len(runs) < MIN_REPLICATIONS:
+        return False
+    for metric, precision in targets.items():
+        mean, half_width = ConfidenceInterval([run[metric] for run in runs], confidence)
+        if half_width > precision*abs(mean):
+            return False
+    return True
+
+def RunAdaptiveSweep(trucks, stations, targets=DEFAULT_TARGETS, confidence=DEFAULT_CONFIDENCE, max_replications=DEFAULT_MAX_REPLICATIONS, batch_size=DEFAULT_BATCH_SIZE,
+                     seed=0, workers=None, scheduler='heap', engine='object'):
+    """ Run the simulation for every combination of truck and station counts until the estimates of the target metrics are as precise as requested.
+        Replications are run in parallel batches for every sweep point that hasn't converged yet; after each batch the confidence intervals are updated and a point stops once
+        every target metric's interval is within its relative precision, or once it reaches max_replications. Easy points stop after a few replications while noisy ones get more.
+        Replication r of a point is seeded like RunSweep's, so the results don't depend on the number of workers.
+
+        Args:
+            trucks (iterable): Numbers of mining trucks to simulate
+            stations (iterable): Numbers of unload stations to simulate
+            targets (dict): Relative precision (half-width of the confidence interval as a fraction of the estimate) of each metric in SWEEP_METRICS,
+                            e.g. {'unloads_per_truck': 0.01, 'average_waiting_time': 0.05}
+            confidence (float): Confidence level of the intervals
+            max_replications (int): Most replications for each truck and station count
+            batch_size (int): Number of replications run for each unconverged point in every batch
+            seed (int): Master seed the seed of every replication is derived from
+            workers (int): Number of worker processes; defaults to the number of CPUs. With a single worker the runs are performed in this process.
+            scheduler (str): Name of the task queue implementation to use
+            engine (str): Simulation engine to use (see RunSimulation)
+        Returns:
+            list: One row per truck and station count, ordered by trucks then stations: the row of MergeReplications, whether every target converged,
+                  and the half-width of each target metric's interval (keyed '<metric>_half_width')
+    """
+
+    trucks, stations = list(trucks), list(stations)
+    if not trucks or not stations or min(trucks) < 1 or min(stations) < 1:
+        raise ValueError("The number of mining trucks and unload stations must be greater than zero")
+    unknown = set(targets) - set(SWEEP_METRICS)
+    if unknown or not targets:
+        raise ValueError("Targets must be metrics among {}".format(', '.join(SWEEP_METRICS)))
+    if max_replications < 1 or batch_size < 1:
+        raise ValueError("The number of replications and the batch size must be greater than zero")
+    if not 0 < confidence < 1:
+        raise ValueError("The confidence level must be between 0 and 1")
+
+    runs = {(n, m): [] for n in trucks for m in stations}
+    pending = sorted(runs)
+    workers = workers or os.cpu_count() or 1
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    try:
+        while pending:
+            points = []
+            for n, m in pending:
+                done = len(runs[n, m])
+                points += [(n, m, replication, seed, scheduler, engine) for replication in range(done, min(done + batch_size, max_replications))]
+
+            if executor is None:
+                batch = [_RunReplication(point) for point in points]
+            else:
+                batch = list(executor.map(_RunReplication, points, chunksize=max(1, len(points)//(workers*4))))
+            for run in batch:
+                runs[run['trucks'], run['stations']].append(run)
+
+            pending = [key for key in pending if len(runs[key]) < max_replications and not Converged(runs[key], targets, confidence)]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    rows = []
+    for key in sorted(runs):
+        row = MergeReplications(runs[key])
+        row['converged'] = Converged(runs[key], targets, confidence)
+        for metric in targets:
+            row[metric + '_half_width'] = ConfidenceInterval([run[metric] for run in runs[key]], confidence)[1]
+        rows.append(row)
+    return rows
+
+def DisplayAdaptiveSweep(rows, targets=DEFAULT_TARGETS, confidence=DEFAULT_CONFIDENCE):
+    """ Display the results of an adaptive sweep: the estimate and confidence interval of every target metric and the replications used, one row per truck and station count.
+
+        Args:
+            rows (list): Rows returned by RunAdaptiveSweep
+            targets (dict): The targets the sweep was run with
+            confidence (float): The confidence level the sweep was run with
+    """
+
+    print("\n---Adaptive Sweep Complete ({:g}% confidence intervals)---\n".format(confidence*100))
+    header = "Trucks | Stations | Replications | Converged" + "".join(" | {:>38s}".format(metric) for metric in targets)
+    print(header)
+    print("-"*len(header))
+
+    for row in rows:
+        line = "{n:>6d} | {m:>8d} | {r:>12d} | {c:>9s}".format(n=row['trucks'], m=row['stations'], r=row['replications'], c='yes' if row['converged'] else 'no')
+        for metric in targets:
+            estimate, half_width = row[metric], row[metric + '_half_width']
+            relative = half_width/abs(estimate) if estimate else (0 if not half_width else math.inf)
+            line += " | {:>16.2f} +/- {:>10.2f} ({:>5.1%})".format(estimate, half_width, relative)
+        print(line)
+    print("\nTotal replications: {}".format(sum(row['replications'] for row in rows)))
+
+def DisplaySweep(rows):
+    """ Display the results of a parameter sweep as a table with one row per truck and station count.
+
+        Args:
+            rows (list): Rows returned by RunSweep
+    """
+
+    print("\n---Sweep Complete---\n")
+    print("Trucks | Stations | Replications | Unloads Per Truck | Unloads Per Station | Average Mining Time | Avg Waiting Time Per Unload")
+    print("-"*120)
+
+    for row in rows:
+        print("{n:>6d} | {m:>8d} | {r:>12d} | {upt:>17.2f} | {ups:>19.2f} | {amt:>19s} | {awt:>27s}".format(
+            n=row['trucks'], m=row['stations'], r=row['replications'], upt=row['unloads_per_truck'], ups=row['unloads_per_station'],
+            amt=FormatDuration(row['average_mining_time']), awt=FormatDuration(row['average_waiting_time'])))
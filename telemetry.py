@@ -0,0 +1,142 @@
+import array
+from report import WriteRows
+
+# Default simulated time (in seconds) between two samples
+DEFAULT_INTERVAL = 600
+
+# Fleet-wide columns of every sample, followed by the queue depth of every station ('station_1', 'station_2', ...)
+FLEET_FIELDS = ('time', 'mining', 'travelling', 'queued', 'unloading', 'unloads')
+
+
+class Telemetry():
+    """ Samples the state of the fleet and the stations every interval seconds of simulated time into preallocated ring buffers. Pass an instance to RunSimulation to enable it
+        (object engine only). Samples are taken as the event loop retrieves its tasks, so sampling doesn't schedule any tasks of its own.
+
+        Every sample holds the number of trucks mining, travelling (to or from the unload station), queued at a station waiting for their unload to start, the number of
+        unloads in progress, the number of unloads completed so far, and the number of trucks at every station (including the one unloading).
+        A truck heads back to a mining location as soon as its unload starts, so a truck whose unload is in progress is counted as travelling.
+
+        Attributes:
+            interval (int): Simulated time in seconds between samples
+            capacity (int): Number of samples the buffers hold; once full, the oldest samples are overwritten. Defaults to every sample up to the horizon.
+            count (int): Number of samples taken
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, capacity=None):
+        """ Initialize a Telemetry; its buffers are allocated when the simulation starts """
+
+        if interval < 1:
+            raise ValueError("The telemetry interval must be at least one second")
+        self.interval = interval
+        self.capacity = capacity
+        self.count = 0
+
+    def start(self, n, unload_stations, horizon):
+        """ Allocate the buffers for a simulation. Called by RunSimulation before the first task.
+
+            Args:
+                n (int): Number of mining trucks
+                unload_stations (list): The simulation's UnloadStation instances
+                horizon (int): Time (in seconds) the simulation runs up to
+        """
+
+        samples = horizon//self.interval + 1
+        self.capacity = samples if self.capacity is None else min(self.capacity, samples)
+        self.horizon = horizon
+        self.stations = unload_stations
+        self.trucks = n
+        self.count = 0
+        self.mining = 0
+        self.unloads = 0
+
+        self.columns = [array.array('q', bytes(8*self.capacity)) for _ in FLEET_FIELDS]
+        self.station_depths = array.array('i', bytes(4*self.capacity*len(unload_stations)))
+
+    @property
+    def nbytes(self):
+        """ Memory used by the buffers, fixed once the simulation starts: 48 bytes per sample for the fleet columns plus 4 bytes per station per sample """
+        return sum(column.itemsize*len(column) for column in self.columns) + self.station_depths.itemsize*len(self.station_depths)
+
+    def sampleUntil(self, time):
+        """ Take every sample due before a time, from the current state. Called with the time of every task before it is performed.
+
+            Args:
+                time (int): Time of the next task
+        """
+
+        while self.count*self.interval < time and self.count*self.interval <= self.horizon:
+            self._sample(self.count*self.interval)
+
+    def _sample(self, time):
+        """ Record the current state as the sample for a time """
+
+        slot = self.count % self.capacity
+        stations = self.stations
+        at_stations = unloading = 0
+        depths = self.station_depths
+        offset = slot*len(stations)
+        for i, station in enumerate(stations):
+            depth = len(station.truck_queue)
+            depths[offset + i] = depth
+            at_stations += depth
+            if depth:
+                unloading += 1
+
+        queued = at_stations - unloading
+        values = (time, self.mining, self.trucks - self.mining - queued, queued, unloading, self.unloads)
+        for column, value in zip(self.columns, values):
+            column[slot] = value
+        self.count += 1
+
+    def taskPerformed(self, name):
+        """ Update the running counts for a task that is about to be performed """
+
+        if name == 'startMining':
+            self.mining += 1
+        elif name == 'goToUnloadStation':
+            self.mining -= 1
+        elif name == 'startNextUnload':
+            self.unloads += 1
+
+    def rows(self):
+        """ Yield the samples in the buffers, oldest first, as tuples of the FLEET_FIELDS followed by the queue depth of every station """
+
+        m = len(self.stations)
+        first = max(self.count - self.capacity, 0)
+        for sample in range(first, self.count):
+            slot = sample % self.capacity
+            yield tuple(column[slot] for column in self.columns) + tuple(self.station_depths[slot*m:(slot + 1)*m])
+
+    def fields(self):
+        """ Return the names of the columns of every sample """
+        return FLEET_FIELDS + tuple('station_{}'.format(i + 1) for i in range(len(self.stations)))
+
+    def write(self, path, format=None):
+        """ Write the samples to a CSV (.csv), JSON Lines (.jsonl) or compact binary columnar (.col) file, see report.WriteRows.
+
+            Returns:
+                int: Number of samples written
+        """
+        return WriteRows(path, self.rows(), self.fields(), format)
+
+
+class TelemetryTaskQueue():
+    """ Wraps a task queue (TaskQueue or HeapTaskQueue) and lets a Telemetry take its samples every time a task is retrieved """
+
+    def __init__(self, task_queue, telemetry):
+        self.task_queue = task_queue
+        self.telemetry = telemetry
+
+    @property
+    def queue(self):
+        return self.task_queue.queue
+
+    def enqueue(self, *args):
+        self.task_queue.enqueue(*args)
+
+    def getCurrentTask(self):
+        task = self.task_queue.getCurrentTask()
+        # Every task before this one has been performed, so the state is up to date for the samples due before it
+        self.telemetry.sampleUntil(task[1])
+        self.telemetry.taskPerformed(task[0].__name__)
+        return task
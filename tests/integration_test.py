@@ -1,5 +1,16 @@
 import pytest
-from simulation import MiningTruck, UnloadStation, TaskQueue
+import random
+from simulation import MiningTruck, UnloadStation, TaskQueue, RunSimulation, ResumeSimulation, ENGINES
+from batch_simulation import RunBatchSimulation
+from sweep import RunSweep, RunAdaptiveSweep, DeriveSeed
+from sites import RunSites
+from result_cache import ResultCache
+from telemetry import Telemetry
+import simulation
+from instrumentation import Instrumentation
+from distributions import FleetDistributions
+import constants as const
+from fast_path import IsContentionFree
 
 def test_unload_station_queue_time():
     """ Tests that the queue time returned is the correct value """
@@ -49,3 +60,295 @@ def test_task_queue_initialization():
         assert task.__name__ == "startMining"
         assert time == 0
     
+
+def test_schedulers_produce_identical_results():
+    """ Verify the heap and list task queues produce identical statistics for the same random seed """
+
+    results = []
+    for scheduler in ('list', 'heap'):
+        random.seed(42)
+        trucks, stations = RunSimulation(40, 3, scheduler=scheduler, display=False)
+        results.append((
+            [(t.total_unloads, t.total_times_mined, t.time_spent_waiting, t.time_spent_mining, t.times_traveled) for t in trucks],
+            [(s.total_unloads, s.time_spent_waiting) for s in stations],
+        ))
+
+    assert results[0] == results[1]
+
+def test_engines_produce_identical_results():
+    """ Verify the compact and coalesced engines produce the same statistics as the object engine for the same random seed """
+
+    results = []
+    for engine in ('object', 'compact', 'coalesced'):
+        random.seed(11)
+        trucks, stations = RunSimulation(40, 3, display=False, engine=engine)
+        results.append((
+            [(t.id, t.total_unloads, t.total_times_mined, t.time_spent_waiting, t.time_spent_mining, t.times_traveled) for t in trucks],
+            [(s.id, s.total_unloads, s.time_spent_waiting) for s in stations],
+        ))
+
+    assert results[0] == results[1] == results[2]
+
+@pytest.mark.parametrize('travel_time, unload_time', [(const.TRAVEL_TIME, const.UNLOAD_TIME), (const.TRAVEL_TIME, 2400), (250, 7000)])
+def test_engines_produce_identical_results_for_any_unload_time(monkeypatch, travel_time, unload_time):
+    """ Verify the compact and coalesced engines match the object engine when unloads take longer than the trip to a mining location, so unload completions can't be folded,
+        and when they take longer than a whole cycle, so a truck can arrive at another station before its previous unload completes """
+
+    monkeypatch.setattr(const, 'TRAVEL_TIME', travel_time)
+    monkeypatch.setattr(const, 'UNLOAD_TIME', unload_time)
+    for n, m, seed in ((40, 3, 1), (25, 5, 2), (12, 4, 3), (6, 2, 813440)):
+        results = []
+        for engine in ('object', 'compact', 'coalesced'):
+            trucks, stations = RunSimulation(n, m, display=False, engine=engine, seed=seed, horizon=36000 + seed%1000*997, fast_path=False)
+            results.append(([(t.total_unloads, t.time_spent_waiting, t.times_traveled) for t in trucks], [(s.total_unloads, s.time_spent_waiting) for s in stations]))
+        assert results[0] == results[1] == results[2]
+
+def test_batch_simulation_matches_simulation():
+    """ Verify the NumPy batch engine is reproducible, keeps truck and station counters consistent and matches RunSimulation run with the same seeds """
+
+    n, m, replications = 20, 2, 100
+    result = RunBatchSimulation(n, m, replications, seed=7)
+
+    assert result.total_unloads.shape == (replications, n)
+    assert result.station_total_unloads.shape == (replications, m)
+    assert (RunBatchSimulation(n, m, replications, seed=7).time_spent_mining == result.time_spent_mining).all()
+
+    # Every unload and every second of waiting is counted by both a truck and a station
+    assert (result.total_unloads.sum(axis=1) == result.station_total_unloads.sum(axis=1)).all()
+    assert (result.time_spent_waiting.sum(axis=1) == result.station_time_spent_waiting.sum(axis=1)).all()
+
+    # Replication r draws from the same streams as RunSimulation with the replication's seed, so it's identical unless trucks arriving at the same time were processed
+    # in a different order
+    unloads, identical = [], 0
+    for r in range(replications):
+        trucks, stations = RunSimulation(n, m, display=False, seed=DeriveSeed(7, n, m, r), fast_path=False)
+        unloads.append(sum(truck.total_unloads for truck in trucks) / n)
+        batch_trucks, batch_stations = result.replication(r)
+        identical += all(vars(batch_truck) == {name: getattr(truck, name) for name in vars(batch_truck)} for batch_truck, truck in zip(batch_trucks, trucks))
+
+    assert identical >= 0.75*replications
+    assert abs(result.total_unloads.mean() - sum(unloads) / replications) < 0.02 * result.total_unloads.mean()
+
+    trucks, stations = result.replication(0)
+    assert [truck.id for truck in trucks] == list(range(1, n+1))
+    assert stations[0].total_unloads == result.station_total_unloads[0, 0]
+
+def test_sweep_is_reproducible_across_worker_counts():
+    """ Verify a parameter sweep returns one row per truck and station count, and identical results whether it runs in one or several processes """
+
+    serial = RunSweep(range(5, 11, 5), range(1, 3), replications=2, seed=3, workers=1)
+    parallel = RunSweep(range(5, 11, 5), range(1, 3), replications=2, seed=3, workers=2)
+
+    assert [(row['trucks'], row['stations']) for row in serial] == [(5, 1), (5, 2), (10, 1), (10, 2)]
+    assert all(row['replications'] == 2 for row in serial)
+    assert serial == parallel
+
+def test_resume_from_checkpoint_matches_uninterrupted_run(tmp_path):
+    """ Verify a simulation checkpointed part way through and extended to a later horizon produces the same statistics as an uninterrupted run """
+
+    horizon = 7*24*3600
+    checkpoint_path = str(tmp_path / 'simulation.snapshot')
+
+    def statistics(trucks, stations):
+        return ([(t.total_unloads, t.total_times_mined, t.time_spent_waiting, t.time_spent_mining, t.times_traveled) for t in trucks],
+                [(s.total_unloads, s.time_spent_waiting) for s in stations])
+
+    random.seed(5)
+    expected = statistics(*RunSimulation(20, 2, display=False, horizon=horizon))
+
+    for engine in ('compact', 'coalesced'):
+        random.seed(5)
+        RunSimulation(20, 2, display=False, engine=engine, horizon=10*3600, checkpoint_interval=3600, checkpoint_path=checkpoint_path)
+
+        # The snapshot restores the random state, so draws made in between don't affect the resumed run
+        random.seed(123)
+        assert statistics(*ResumeSimulation(checkpoint_path, horizon=horizon, display=False)) == expected
+
+def test_instrumentation_counts_tasks_without_changing_results():
+    """ Verify the instrumentation report matches the simulation's statistics and that instrumenting a run doesn't change its results """
+
+    random.seed(8)
+    trucks, stations = RunSimulation(30, 2, display=False)
+    expected = [(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks]
+
+    instrumentation = Instrumentation()
+    random.seed(8)
+    trucks, stations = RunSimulation(30, 2, display=False, instrumentation=instrumentation)
+    report = instrumentation.report()
+
+    assert [(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks] == expected
+    assert report['tasks_by_name']['startMining'] == sum(t.total_times_mined for t in trucks)
+    assert report['tasks_by_name']['goToUnloadStation'] + report['tasks_by_name']['goToMiningLocation'] == sum(t.times_traveled for t in trucks)
+    assert report['tasks_by_name']['startNextUnload'] == sum(s.total_unloads for s in stations)
+    assert report['tasks_by_name']['unload'] == report['station_selections']
+    assert report['tasks'] == sum(report['tasks_by_name'].values())
+    assert report['peak_queue_depth'] >= 30
+    assert sum(report['station_queue_length_histogram'].values()) == report['station_selections']
+
+    # Every timed operation, including scheduling the trucks' initial tasks, falls within the wall time
+    instrumentation = Instrumentation()
+    RunSimulation(20000, 2, display=False, seed=8, horizon=0, instrumentation=instrumentation)
+    assert instrumentation.scheduling_calls >= 20000
+    assert instrumentation.scheduling_time + instrumentation.selection_time <= instrumentation.wall_time
+
+def test_contention_free_fast_path_matches_event_loop():
+    """ Verify the fast path for configurations with at least as many stations as trucks has no waiting, consistent counters and the same average results as the event loop """
+
+    n, m, replications = 10, 10, 100
+    results = {True: [], False: []}
+
+    for fast_path in (True, False):
+        for seed in range(replications):
+            random.seed(seed)
+            trucks, stations = RunSimulation(n, m, display=False, fast_path=fast_path)
+            assert all(truck.time_spent_waiting == 0 for truck in trucks)
+            assert sum(truck.total_unloads for truck in trucks) == sum(station.total_unloads for station in stations)
+            results[fast_path].append((sum(truck.total_unloads for truck in trucks), stations[0].total_unloads))
+
+    for column in range(2):
+        fast = sum(result[column] for result in results[True]) / replications
+        event_loop = sum(result[column] for result in results[False]) / replications
+        assert abs(fast - event_loop) < 0.02 * event_loop
+
+def test_fast_path_is_skipped_when_trucks_can_return_before_their_unload_completes(monkeypatch):
+    """ Verify configurations with enough stations still run the event loop when an unload outlasts a truck's shortest cycle, since trucks can then wait """
+
+    monkeypatch.setattr(const, 'UNLOAD_TIME', 8000)
+    assert not IsContentionFree(4, 4)
+    results = []
+    for fast_path in (True, False):
+        trucks, stations = RunSimulation(4, 4, display=False, seed=5, fast_path=fast_path)
+        results.append(([(t.total_unloads, t.time_spent_waiting) for t in trucks], [s.total_unloads for s in stations]))
+    assert results[0] == results[1]
+    assert any(waiting for _, waiting in results[0][0])
+
+def test_distributions_match_running_totals():
+    """ Verify enabling distributions doesn't change a run's results and that the sketches agree with the trucks' and stations' running totals """
+
+    random.seed(6)
+    trucks, stations = RunSimulation(30, 2, display=False)
+    expected = [(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks]
+
+    random.seed(6)
+    trucks, stations = RunSimulation(30, 2, display=False, distributions=True)
+    assert [(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks] == expected
+
+    for truck in trucks:
+        assert truck.mining_times.count == truck.total_times_mined
+        assert truck.mining_times.mean*truck.mining_times.count == pytest.approx(truck.time_spent_mining)
+        assert truck.wait_times.mean*truck.wait_times.count == pytest.approx(truck.time_spent_waiting)
+        assert truck.cycle_times.count == truck.total_times_mined - 1
+        assert truck.cycle_times.min >= 3600 + 2*const.TRAVEL_TIME
+
+    fleet = FleetDistributions(trucks, stations)
+    assert fleet['truck_wait_times'].count == fleet['station_wait_times'].count == fleet['station_queue_lengths'].count
+    assert fleet['station_wait_times'].mean*fleet['station_wait_times'].count == pytest.approx(sum(s.time_spent_waiting for s in stations))
+    assert fleet['truck_wait_times'].max == fleet['station_wait_times'].max
+
+def test_seed_reproduces_runs_across_engines():
+    """ Verify a master seed produces the same results with every engine regardless of the random module's state """
+
+    results = []
+    for state, engine in enumerate(ENGINES):
+        random.seed(state)
+        trucks, stations = RunSimulation(25, 3, display=False, engine=engine, seed=42)
+        results.append(([(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks], [(s.total_unloads, s.time_spent_waiting) for s in stations]))
+    assert results[0] == results[1] == results[2]
+
+    trucks, _ = RunSimulation(25, 3, display=False, seed=43)
+    assert [(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks] != results[0][0]
+
+    # Without contention a truck's statistics only depend on its own stream, so the fast path matches the event loop
+    fast, _ = RunSimulation(8, 8, display=False, seed=42)
+    event_loop, _ = RunSimulation(8, 8, display=False, seed=42, fast_path=False)
+    assert [(t.total_unloads, t.time_spent_mining, t.times_traveled) for t in fast] == [(t.total_unloads, t.time_spent_mining, t.times_traveled) for t in event_loop]
+
+def test_sites_merge_independent_site_runs():
+    """ Verify a multi-site run matches running each site on its own, regardless of the number of workers """
+
+    layout = [(12, 2), (30, 3), (4, 1)]
+    results = {}
+    for workers in (1, 3):
+        trucks, stations, summaries = RunSites(layout, seed=5, workers=workers)
+        results[workers] = ([(t.id, t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in trucks], [(s.id, s.total_unloads, s.time_spent_waiting) for s in stations], summaries)
+    assert results[1] == results[3]
+
+    trucks, stations, summaries = results[1]
+    assert len(trucks) == 46 and len(stations) == 6
+    assert [summary['site'] for summary in summaries] == [0, 1, 2]
+
+    site_trucks, site_stations = RunSimulation(30, 3, display=False, seed=DeriveSeed(5, 'site', 1))
+    assert [t[1:] for t in trucks[12:42]] == [(t.total_unloads, t.time_spent_waiting, t.time_spent_mining) for t in site_trucks]
+    assert [s[1:] for s in stations[2:5]] == [(s.total_unloads, s.time_spent_waiting) for s in site_stations]
+    assert summaries[1]['total_unloads'] == sum(s.total_unloads for s in site_stations)
+
+def test_result_cache_returns_stored_statistics(tmp_path, monkeypatch):
+    """ Verify a cached run returns the statistics of the original run without simulating, and that runs without a seed aren't cached """
+
+    cache = ResultCache(str(tmp_path))
+    trucks, stations = RunSimulation(20, 2, display=False, seed=9, cache=cache)
+    expected = ([(t.id, t.total_unloads, t.time_spent_waiting, t.time_spent_mining, t.times_traveled) for t in trucks], [(s.id, s.total_unloads, s.time_spent_waiting) for s in stations])
+
+    def Fail(*args, **kwargs):
+        raise AssertionError("the simulation ran despite a cached result")
+    monkeypatch.setattr(simulation, 'RunObjectSimulation', Fail)
+    monkeypatch.setattr(simulation, 'RunCompactSimulation', Fail)
+
+    # Every engine produces the same results, so they share cached results
+    for engine in ENGINES:
+        trucks, stations = RunSimulation(20, 2, display=False, seed=9, cache=cache, engine=engine)
+        assert ([(t.id, t.total_unloads, t.time_spent_waiting, t.time_spent_mining, t.times_traveled) for t in trucks], [(s.id, s.total_unloads, s.time_spent_waiting) for s in stations]) == expected
+
+    with pytest.raises(AssertionError):
+        RunSimulation(20, 2, display=False, seed=10, cache=cache)
+    with pytest.raises(AssertionError):
+        RunSimulation(20, 2, display=False, cache=cache)
+    assert len(list(tmp_path.iterdir())) == 1
+
+def test_telemetry_samples_fleet_state_without_extra_tasks():
+    """ Verify telemetry samples are consistent with the run's statistics, wrap around in a ring buffer, and don't add tasks to the task queue """
+
+    instrumentation = Instrumentation()
+    trucks, stations = RunSimulation(40, 3, display=False, seed=2, instrumentation=instrumentation)
+    expected = [(t.total_unloads, t.time_spent_waiting) for t in trucks]
+
+    telemetry, telemetry_instrumentation = Telemetry(interval=3600), Instrumentation()
+    trucks, stations = RunSimulation(40, 3, display=False, seed=2, telemetry=telemetry, instrumentation=telemetry_instrumentation)
+    assert [(t.total_unloads, t.time_spent_waiting) for t in trucks] == expected
+    assert telemetry_instrumentation.scheduling_calls == instrumentation.scheduling_calls
+
+    rows = list(telemetry.rows())
+    assert len(rows) == telemetry.count == 73 and telemetry.nbytes == 73*(48 + 4*3)
+    assert [row[0] for row in rows] == [3600*i for i in range(73)]
+    for row in rows:
+        assert row[1] + row[2] + row[3] == 40
+        assert row[3] == sum(depth - 1 for depth in row[6:] if depth)
+    assert rows[0][1] == 40 and rows[-1][5] == sum(s.total_unloads for s in stations)
+
+    ring = Telemetry(interval=3600, capacity=10)
+    RunSimulation(40, 3, display=False, seed=2, telemetry=ring)
+    assert list(ring.rows()) == rows[-10:]
+
+def test_adaptive_sweep_stops_once_targets_are_met():
+    """ Verify the adaptive sweep stops each point once its targets are met or the cap is reached, and doesn't depend on the number of workers """
+
+    targets = {'unloads_per_truck': 0.01, 'average_waiting_time': 0.2}
+    rows = RunAdaptiveSweep([6, 12], [1], targets=targets, max_replications=24, batch_size=4, seed=1, workers=1)
+    assert rows == RunAdaptiveSweep([6, 12], [1], targets=targets, max_replications=24, batch_size=4, seed=1, workers=2)
+
+    for row in rows:
+        assert 5 <= row['replications'] <= 24
+        if row['converged']:
+            assert all(row[metric + '_half_width'] <= precision*row[metric] for metric, precision in targets.items())
+        else:
+            assert row['replications'] == 24
+
+    # The replications are the same runs as a fixed-size sweep's
+    fixed = RunSweep([6], [1], replications=rows[0]['replications'], seed=1, workers=1)
+    assert fixed[0]['unloads_per_truck'] == pytest.approx(rows[0]['unloads_per_truck'])
+
+    with pytest.raises(ValueError):
+        RunAdaptiveSweep([6], [1], targets={'unknown_metric': 0.01})
+    for confidence in (0, 1, 1.5):
+        with pytest.raises(ValueError):
+            RunAdaptiveSweep([6], [1], confidence=confidence)
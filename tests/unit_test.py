@@ -1,5 +1,20 @@
+import argparse
+import csv
+import json
+import os
+import pickle
 import pytest
-from simulation import MiningTruck, UnloadStation, TaskQueue
+import random
+import tracemalloc
+import types
+from simulation import MiningTruck, UnloadStation, TaskQueue, HeapTaskQueue, UnloadStationIndex, GetNextUnloadStation, ParseRange, ParseArgs, TASK_PRIORITY_UNLOAD_COMPLETE
+from compact_simulation import CompactSimulation, RunCompactSimulation, BYTES_PER_TRUCK, ID_MASK
+from benchmark import CompareToBaseline
+from sweep import TQuantile, ConfidenceInterval
+from streams import MiningStreams, HistogramDuration
+from distributions import QuantileSketch, RELATIVE_ACCURACY, MAX_BINS
+from result_cache import ResultCache, CacheKey
+from report import SelectEntities, TruckSortKey, FormatDuration, WriteEntities, ReadColumnar, STATION_FIELDS
 
 def test_mining_truck_initialization():
     """Test that a MiningTruck is initialized with correct attributes."""
@@ -16,9 +31,263 @@ def test_unload_station_initialization():
     """Test that an UnloadStation is initialized with correct attributes. Verify station is not in use."""
     station = UnloadStation(id=1)
     assert station.id == 1
-    assert station.truck_queue == []
+    assert len(station.truck_queue) == 0
+    assert station.tail_free_time == 0
     assert station.start_time == None
     assert station.time_spent_waiting == 0
     assert station.total_unloads == 0
     assert station.inUse() is False
 
+
+def test_heap_task_queue_ordering():
+    """Test that the HeapTaskQueue orders tasks by time, runs unload completions first and otherwise preserves insertion order."""
+    task_queue = HeapTaskQueue()
+    station = UnloadStation(id=1)
+    truck1 = MiningTruck(1, task_queue)
+    truck2 = MiningTruck(2, task_queue)
+
+    task_queue.enqueue((truck2.goToUnloadStation, 100))
+    task_queue.enqueue((truck1.goToUnloadStation, 100))
+    task_queue.enqueue((station.startNextUnload, 100), TASK_PRIORITY_UNLOAD_COMPLETE)
+    task_queue.enqueue((truck1.unload, 50))
+
+    order = [task_queue.getCurrentTask() for _ in range(6)]
+    assert [time for _, time in order] == [0, 0, 50, 100, 100, 100]
+    assert order[0][0].__self__ is truck1 and order[1][0].__self__ is truck2
+    assert order[3][0] == station.startNextUnload
+    assert order[4][0] == truck2.goToUnloadStation
+    assert order[5][0] == truck1.goToUnloadStation
+
+def test_unload_station_index_matches_scan():
+    """Test that the UnloadStationIndex picks the same station as GetNextUnloadStation as stations fill up and free up."""
+    task_queue = TaskQueue()
+    stations = [UnloadStation(id=i+1) for i in range(3)]
+    index = UnloadStationIndex(stations)
+
+    # Trucks arrive every 60 seconds; stations are freed when their unloads complete
+    pending = []
+    for i in range(12):
+        cur_time = i*60
+        for completion_time, station in sorted(pending, key=lambda p: p[0]):
+            if completion_time <= cur_time:
+                station.startNextUnload(completion_time)
+        pending = [p for p in pending if p[0] > cur_time]
+
+        expected = GetNextUnloadStation(stations, cur_time)
+        station = index.getNextUnloadStation(cur_time)
+        assert station is expected
+
+        station.enqueue(MiningTruck(i+1, task_queue), cur_time)
+        index.update(station)
+        pending.append((station.tail_free_time, station))
+
+def test_parse_range():
+    """Test that sweep ranges are parsed with an inclusive stop and an optional step."""
+    assert list(ParseRange('5')) == [5]
+    assert list(ParseRange('1:3')) == [1, 2, 3]
+    assert list(ParseRange('10:30:10')) == [10, 20, 30]
+    with pytest.raises(argparse.ArgumentTypeError):
+        ParseRange('1:x')
+
+def test_parse_args_rejects_invalid_horizon_and_intervals():
+    """Test that negative horizons, non-positive checkpoint and telemetry intervals and checkpoint intervals without a checkpoint path are rejected."""
+    assert ParseArgs(['-n', '2', '-m', '1', '--checkpoint', 'snapshot', '--checkpoint-interval', '3600']).checkpoint_interval == 3600
+    for argv in (['--horizon', '-1'], ['--checkpoint', 'snapshot', '--checkpoint-interval', '0'], ['--checkpoint', 'snapshot', '--checkpoint-interval', '-60'], ['--checkpoint-interval', '3600'],
+                 ['--telemetry', 'telemetry.csv', '--telemetry-interval', '0'], ['--telemetry', 'telemetry.csv', '--telemetry-interval', '-60']):
+        with pytest.raises(SystemExit):
+            ParseArgs(['-n', '2', '-m', '1'] + argv)
+    with pytest.raises(ValueError):
+        CompactSimulation(2, 1).run(3600, checkpoint_interval=-60)
+
+def test_parse_args_rejects_options_ignored_by_resume():
+    """Test that options a resumed simulation can't honour are rejected along with --resume."""
+    assert ParseArgs(['--resume', 'snapshot', '--horizon', '7200']).resume == 'snapshot'
+    for argv in (['--instrument', '-'], ['--distributions'], ['--telemetry', 'telemetry.csv']):
+        with pytest.raises(SystemExit):
+            ParseArgs(['--resume', 'snapshot'] + argv)
+
+def test_parse_args_keeps_options_given_before_subcommands():
+    """Test that options shared with the top level keep their value whether they are given before or after the sweep and sites subcommands."""
+    args = ParseArgs(['--seed', '5', '--engine', 'compact', '--top', '2', 'sites', '-s', '4:1'])
+    assert (args.seed, args.engine, args.scheduler, args.top, args.bottom) == (5, 'compact', 'heap', 2, None)
+    args = ParseArgs(['sites', '-s', '4:1', '--top', '1', '--bottom', '1', '--engine', 'coalesced'])
+    assert (args.seed, args.engine, args.top, args.bottom) == (0, 'coalesced', 1, 1)
+    args = ParseArgs(['--seed', '7', 'sweep', '-n', '1:2', '-m', '1'])
+    assert (args.seed, args.engine) == (7, 'object')
+    assert ParseArgs(['sweep', '-n', '1:2', '-m', '1', '--seed', '3']).seed == 3
+
+    for argv in (['sweep', '-n', '1', '-m', '1', '-r', '0'], ['sweep', '-n', '1', '-m', '1', '--workers', '-1'], ['sites', '-s', '3:1', '--workers', '0'],
+                 ['sweep', '-n', '1', '-m', '1', '--target', 'unloads_per_truck=0.01', '--max-replications', '0']):
+        with pytest.raises(SystemExit):
+            ParseArgs(argv)
+
+    # Options of a single run are rejected rather than silently ignored by the subcommands
+    for argv in (['--horizon', '3600', 'sites', '-s', '3:1'], ['--trucks-output', 'trucks.csv', 'sites', '-s', '3:1'], ['--instrument', '-', 'sweep', '-n', '1', '-m', '1'],
+                 ['--distributions', 'sites', '-s', '3:1'], ['--telemetry', 'telemetry.csv', 'sweep', '-n', '1', '-m', '1'], ['--top', '1', 'sweep', '-n', '1', '-m', '1']):
+        with pytest.raises(SystemExit):
+            ParseArgs(argv)
+
+def test_compact_engine_rejects_fleets_past_id_bits():
+    """Test that the compact engine refuses fleets whose indexes don't fit in the ID_BITS bits of an encoded task."""
+    with pytest.raises(ValueError):
+        CompactSimulation(ID_MASK + 2, 1)
+    with pytest.raises(ValueError):
+        CompactSimulation(1, ID_MASK + 2)
+
+def test_compact_engine_bytes_per_truck():
+    """Test that the compact engine's peak memory per truck stays within the documented BYTES_PER_TRUCK."""
+    num_trucks = 5000
+    random.seed(0)
+    tracemalloc.start()
+    try:
+        trucks, stations = RunCompactSimulation(num_trucks, 10)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert len(trucks) == num_trucks and len(stations) == 10
+    assert peak/num_trucks <= BYTES_PER_TRUCK
+
+def test_benchmark_regression_check():
+    """Test that benchmarks are only reported as regressions when their throughput drops past the threshold."""
+    baseline = {'simulation/object/n=10/m=1': {'events_per_second': 1000}, 'scheduler/heap/depth=10': {'operations_per_second': 500}}
+    results = {
+        'simulation/object/n=10/m=1': {'events_per_second': 850},
+        'scheduler/heap/depth=10': {'operations_per_second': 300},
+        'scheduler/list/depth=10': {'operations_per_second': 1},
+    }
+
+    assert CompareToBaseline(results, baseline, threshold=0.2) == [('scheduler/heap/depth=10', 500, 300)]
+    assert len(CompareToBaseline(results, baseline, threshold=0.1)) == 2
+
+def test_select_entities_matches_full_sort():
+    """Test that partial selection of the top and bottom trucks matches the ends of the fully sorted list."""
+    rng = random.Random(1)
+    trucks = [types.SimpleNamespace(id=i+1, total_unloads=rng.randint(10, 15), time_spent_mining=rng.randint(3600, 18000)*10, total_times_mined=10) for i in range(200)]
+    ordered = sorted(trucks, key=TruckSortKey, reverse=True)
+
+    assert SelectEntities(trucks, TruckSortKey) == ordered
+    assert SelectEntities(trucks, TruckSortKey, top=5) == ordered[:5]
+    assert SelectEntities(trucks, TruckSortKey, bottom=5) == ordered[-5:]
+    assert SelectEntities(trucks, TruckSortKey, top=3, bottom=2) == ordered[:3] + ordered[-2:]
+
+def test_format_duration():
+    """Test that durations are formatted as hours, minutes and seconds, including durations longer than a day."""
+    assert FormatDuration(0) == "0h 00m 00s"
+    assert FormatDuration(3725) == "1h 02m 05s"
+    assert FormatDuration(3725.9) == "1h 02m 05s"
+    assert FormatDuration(90061) == "25h 01m 01s"
+
+def test_write_entities_formats(tmp_path):
+    """Test that station statistics written as CSV, JSON Lines and columnar files contain every station."""
+    stations = [types.SimpleNamespace(id=i+1, total_unloads=i*10, time_spent_waiting=i*300) for i in range(5)]
+
+    assert WriteEntities(str(tmp_path / 'stations.csv'), stations, STATION_FIELDS) == 5
+    with open(tmp_path / 'stations.csv') as f:
+        assert list(csv.reader(f))[2] == ['2', '10', '300']
+
+    WriteEntities(str(tmp_path / 'stations.jsonl'), iter(stations), STATION_FIELDS)
+    with open(tmp_path / 'stations.jsonl') as f:
+        assert [json.loads(line)['total_unloads'] for line in f] == [0, 10, 20, 30, 40]
+
+    WriteEntities(str(tmp_path / 'stations.col'), stations, STATION_FIELDS)
+    columns = ReadColumnar(str(tmp_path / 'stations.col'))
+    assert list(columns['id']) == [1, 2, 3, 4, 5]
+    assert list(columns['time_spent_waiting']) == [0, 300, 600, 900, 1200]
+
+def test_quantile_sketch_accuracy_and_merge():
+    """ Verify sketch quantiles are within the relative accuracy of the exact quantiles, and that merging sketches matches a single sketch of every value """
+
+    rng = random.Random(4)
+    values = [rng.randint(0, 18000) for _ in range(10000)]
+    parts = [QuantileSketch() for _ in range(4)]
+    whole = QuantileSketch()
+    for i, value in enumerate(values):
+        parts[i % 4].add(value)
+        whole.add(value)
+
+    merged = QuantileSketch()
+    for part in parts:
+        merged.merge(part)
+
+    ordered = sorted(values)
+    mean = sum(values)/len(values)
+    for sketch in (whole, merged):
+        assert (sketch.count, sketch.min, sketch.max) == (len(values), ordered[0], ordered[-1])
+        assert sketch.mean == pytest.approx(mean)
+        assert sketch.variance == pytest.approx(sum((v - mean)**2 for v in values)/len(values))
+        for q in (0.5, 0.95, 0.99):
+            exact = ordered[int(q*(len(values) - 1))]
+            assert abs(sketch.quantile(q) - exact) <= RELATIVE_ACCURACY*exact + 1e-9
+    assert merged.summary() == pytest.approx(whole.summary())
+
+    # Memory stays fixed however wide the range of values is
+    wide = QuantileSketch()
+    for exponent in range(4*MAX_BINS):
+        wide.add(1.01**exponent)
+    assert len(wide._bins) <= MAX_BINS
+    assert wide.quantile(1) == wide.max
+
+def test_mining_streams_are_independent_of_draw_order():
+    """ Verify every truck's durations depend only on the seed, the truck and the draw, including durations past the first block """
+
+    ordered = MiningStreams(5, seed=3)
+    expected = [[ordered.draw(truck) for _ in range(3*ordered.block_size)] for truck in range(5)]
+
+    shuffled = MiningStreams(5, seed=3)
+    draws = [truck for truck in range(5) for _ in range(3*shuffled.block_size)]
+    random.Random(0).shuffle(draws)
+    actual = [[] for _ in range(5)]
+    for truck in draws:
+        actual[truck].append(shuffled.draw(truck))
+
+    assert actual == expected
+    assert expected == MiningStreams(5, seed=3).sample(0, 5, 3*ordered.block_size).tolist()
+    assert len(ordered.buffer) == 5*ordered.block_size
+    assert all(3600 <= duration <= 18000 for durations in expected for duration in durations)
+    assert [durations[0] for durations in expected] != [MiningStreams(5, seed=4).draw(truck) for truck in range(5)]
+
+    histogram = MiningStreams(1000, seed=3, distribution=HistogramDuration([3600, 7200, 18000], [1, 3])).sample(0, 1000, 10)
+    assert histogram.min() >= 3600 and histogram.max() < 18000
+    assert abs((histogram < 7200).mean() - 0.25) < 0.01
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    """ Verify the result cache stays within its size by evicting the least recently used results, and treats unreadable files as misses """
+
+    cache = ResultCache(str(tmp_path))
+    trucks, stations = RunCompactSimulation(50, 5, seed=1)
+    keys = [CacheKey(50, 5, seed) for seed in range(3)]
+    for key in keys:
+        cache.put(key, trucks, stations)
+    assert cache.get(keys[0])[0][7].total_unloads == trucks[7].total_unloads
+    assert cache.get(CacheKey(50, 5, 3)) is None
+
+    # Make the first result the most recently used, then shrink the cache to two results
+    for age, key in enumerate((keys[1], keys[2], keys[0])):
+        os.utime(cache.path(key), (age, age))
+    cache.max_bytes = 2*cache.size()//3
+    assert cache.evict() == 1
+    assert cache.get(keys[1]) is None and cache.get(keys[2]) is not None and cache.get(keys[0]) is not None
+
+    # Files that aren't complete cached results, including pickles, are misses and are removed without being unpickled
+    for content in (b'not a result', pickle.dumps([1, 2]), pickle.dumps({'key': keys[2]}), open(cache.path(keys[0]), 'rb').read()[:-1]):
+        with open(cache.path(keys[2]), 'wb') as f:
+            f.write(content)
+        assert cache.get(keys[2]) is None
+        assert not os.path.exists(cache.path(keys[2]))
+    assert cache.clear() == 1 and cache.size() == 0
+
+def test_confidence_interval():
+    """ Verify the t quantile against tabulated values and the confidence interval of a small sample """
+
+    for p, dof, expected in ((0.975, 1, 12.706), (0.975, 2, 4.303), (0.975, 4, 2.776), (0.975, 10, 2.228), (0.975, 30, 2.042), (0.975, 1000, 1.962),
+                             (0.995, 4, 4.604), (0.995, 30, 2.750), (0.9995, 1, 636.619), (0.6, 5, 0.267)):
+        assert TQuantile(p, dof) == pytest.approx(expected, abs=0.001)
+    assert TQuantile(0.025, 4) == -TQuantile(0.975, 4)
+    with pytest.raises(ValueError):
+        TQuantile(1, 4)
+
+    mean, half_width = ConfidenceInterval([10, 12, 14, 16, 18])
+    assert mean == 14
+    assert half_width == pytest.approx(2.776*(10**0.5)/(5**0.5), rel=0.005)
+    assert ConfidenceInterval([3])[1] == float('inf')